@@ -0,0 +1,342 @@
+"""
+Benchmark of the image pipeline.
+
+Generates a corpus of images (sizes, modes and EXIF orientations) and runs
+image_editor functions and the function handler (with local_s3 standing in for S3) over it.
+Each case runs in a new process to measure its peak RSS.
+Reports p50/p95 latency, peak RSS and output bytes per case and saves the results as JSON,
+cases rejected (e.g. exceeding the input budget) are recorded as such.
+
+Usage:
+    python benchmarks/bench_pipeline.py --output results.json
+    python benchmarks/bench_pipeline.py --compare before.json after.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+from contextlib import redirect_stdout
+from base64 import b64decode
+from time import perf_counter, strftime
+
+THUMBNAILER_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "thumbnailer"
+)
+
+CORPUS_BUCKET = "corpus"
+SIZES_MP = [0.3, 2, 12, 24, 50]
+# 3:2 aspect ratio, as of most camera sensors
+ASPECT_RATIO = 3 / 2
+MODES = ["RGB", "RGBA", "P", "CMYK", "L"]
+# formats supporting the modes
+MODE_FORMATS = {"RGB": "JPEG", "RGBA": "PNG", "P": "PNG", "CMYK": "JPEG", "L": "JPEG"}
+ORIENTATIONS = [1, 2, 3, 4, 5, 6, 7, 8]
+# size (MP) of RGB JPEG images with all the EXIF orientations
+ORIENTATIONS_SIZE_MP = 12
+
+LONG_EDGE_PIXELS = 300
+FIT_PIXELS = (200, 200)
+OPS = ["info", "resize", "fit", "handler-info", "handler-thumbnail", "handler-fit"]
+
+
+def _case_name(size_mp, mode, orientation):
+    return "{}mp-{}-o{}".format(size_mp, mode.lower(), orientation)
+
+
+def corpus_cases(sizes_mp, modes):
+    """Returns list of cases (dicts)."""
+    cases = [
+        dict(size_mp=size_mp, mode=mode, orientation=1)
+        for size_mp in sizes_mp
+        for mode in modes
+    ]
+    if "RGB" in modes:
+        cases += [
+            dict(size_mp=ORIENTATIONS_SIZE_MP, mode="RGB", orientation=orientation)
+            for orientation in ORIENTATIONS
+            if orientation != 1
+        ]
+    for case in cases:
+        case["name"] = _case_name(case["size_mp"], case["mode"], case["orientation"])
+        extension = MODE_FORMATS[case["mode"]].lower().replace("jpeg", "jpg")
+        case["file"] = "{}.{}".format(case["name"], extension)
+    return cases
+
+
+def generate_image(size_mp, mode, orientation, path):
+    """Generates image looking (and compressing) more like a photo than a noise."""
+    from PIL import Image
+
+    height = int((size_mp * 1e6 / ASPECT_RATIO) ** 0.5)
+    width = int(height * ASPECT_RATIO)
+    gradient = Image.linear_gradient("L")
+    red = gradient.resize((width, height))
+    green = gradient.transpose(Image.ROTATE_90).resize((width, height))
+    blue = Image.effect_noise((max(1, width // 16), max(1, height // 16)), 64)
+    blue = blue.resize((width, height), Image.BICUBIC)
+    im = Image.merge("RGB", (red, green, blue))
+    if mode == "RGBA":
+        im.putalpha(green)
+    elif mode == "P":
+        im = im.convert("P", palette=Image.ADAPTIVE)
+    elif mode != "RGB":
+        im = im.convert(mode)
+    options = {}
+    if MODE_FORMATS[mode] == "JPEG":
+        options = dict(quality=90)
+        if orientation != 1:
+            exif = Image.Exif()
+            exif[0x0112] = orientation
+            options["exif"] = exif.tobytes()
+    im.save(path, MODE_FORMATS[mode], **options)
+
+
+def generate_corpus(corpus_dir, cases):
+    bucket_dir = os.path.join(corpus_dir, CORPUS_BUCKET)
+    os.makedirs(bucket_dir, exist_ok=True)
+    for case in cases:
+        path = os.path.join(bucket_dir, case["file"])
+        if not os.path.isfile(path):
+            print("Generating {}".format(path), file=sys.stderr)
+            generate_image(case["size_mp"], case["mode"], case["orientation"], path)
+
+
+def _reset_peak_rss():
+    """Resets the peak RSS (Linux only), returns the current RSS in bytes."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    return _rss_bytes("VmRSS:")
+
+
+def _rss_bytes(field="VmHWM:"):
+    """Returns the peak (VmHWM) or current (VmRSS) RSS in bytes."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # not reset, includes the parent process on Linux and is in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    index = max(0, int(round(percent / 100 * len(values) + 0.5)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+def _api_event(resource, path_parameters):
+    return dict(resource=resource, headers={}, pathParameters=path_parameters)
+
+
+class _Rejected(Exception):
+    """The case is rejected by the handler, e.g. exceeding the input budget."""
+
+
+def _handler_body_size(response):
+    """Returns size of the response body, raises _Rejected if the status is not 200."""
+    if response["statusCode"] != 200:
+        raise _Rejected("status {}".format(response["statusCode"]))
+    if response["isBase64Encoded"]:
+        return len(b64decode(response["body"]))
+    return len(response["body"])
+
+
+def run_case(task):
+    """Runs the operation on the case, in a new process."""
+    corpus_dir, case, op, repeat, warmup = task
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_XRAY_SDK_ENABLED", "false")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    sys.path.insert(0, THUMBNAILER_DIR)
+    # keep stdout for the results
+    with redirect_stdout(sys.stderr):
+        import image_editor
+        import app
+    from local_s3 import LocalS3Client
+    from vfile import S3File
+
+    with open(os.path.join(corpus_dir, CORPUS_BUCKET, case["file"]), "rb") as f:
+        data = f.read()
+    uri = "s3://{}/{}".format(CORPUS_BUCKET, case["file"])
+
+    if op.startswith("handler-"):
+        S3File.set_client(LocalS3Client(corpus_dir))
+
+    def run():
+        if op == "info":
+            image_editor.get_size_image_data(data)
+            return 0
+        if op == "resize":
+            return len(image_editor.resize_image_data(data, LONG_EDGE_PIXELS))
+        if op == "fit":
+            return len(image_editor.fit_image_data(data, *FIT_PIXELS))
+        if op == "handler-info":
+            event = _api_event("/thumbnailer/info/{uri}", dict(uri=uri))
+        elif op == "handler-thumbnail":
+            event = _api_event(
+                "/thumbnailer/thumbnail/{uri}/long-edge/{long_edge_pixels}",
+                dict(uri=uri, long_edge_pixels=str(LONG_EDGE_PIXELS)),
+            )
+        elif op == "handler-fit":
+            event = _api_event(
+                "/thumbnailer/fit/{uri}/width/{width_pixels}/height/{height_pixels}",
+                dict(
+                    uri=uri,
+                    width_pixels=str(FIT_PIXELS[0]),
+                    height_pixels=str(FIT_PIXELS[1]),
+                ),
+            )
+        else:
+            raise ValueError(op)
+        return _handler_body_size(app.lambda_handler(event, None))
+
+    result = dict(
+        case=case["name"],
+        op=op,
+        size_mp=case["size_mp"],
+        mode=case["mode"],
+        orientation=case["orientation"],
+        input_bytes=len(data),
+    )
+    rss_before = _reset_peak_rss()
+    try:
+        for _ in range(warmup):
+            run()
+        durations = []
+        for _ in range(repeat):
+            started = perf_counter()
+            output_bytes = run()
+            durations.append((perf_counter() - started) * 1000)
+    except (_Rejected, image_editor.ImageTooLargeException) as e:
+        # e.g. bigger than INPUT_PIXELS_MAX, recorded instead of measured
+        return dict(result, rejected=str(e))
+    rss_peak = _rss_bytes()
+    return dict(
+        result,
+        output_bytes=output_bytes,
+        runs=repeat,
+        p50_ms=round(_percentile(durations, 50), 3),
+        p95_ms=round(_percentile(durations, 95), 3),
+        peak_rss_mb=round(rss_peak / 2**20, 1),
+        peak_rss_increase_mb=round((rss_peak - rss_before) / 2**20, 1),
+    )
+
+
+def run_benchmark(args):
+    cases = corpus_cases(args.sizes, args.modes)
+    generate_corpus(args.corpus_dir, cases)
+    tasks = [
+        (args.corpus_dir, case, op, args.repeat, args.warmup)
+        for case in cases
+        for op in args.ops
+    ]
+    # a new process for each task, so that the peak RSS is of the task only
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        for result in pool.imap(run_case, tasks):
+            print(_format_result(result), file=sys.stderr)
+            results.append(result)
+    from PIL import __version__ as pillow_version
+
+    return dict(
+        meta=dict(
+            time=strftime("%Y-%m-%dT%H:%M:%S%z"),
+            python=platform.python_version(),
+            pillow=pillow_version,
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+            repeat=args.repeat,
+            warmup=args.warmup,
+        ),
+        results=results,
+    )
+
+
+def _format_result(result):
+    if "rejected" in result:
+        return "{case:<18} {op:<18} rejected: {rejected}".format(**result)
+    return "{case:<18} {op:<18} p50 {p50_ms:>9.1f} ms  p95 {p95_ms:>9.1f} ms  peak RSS {peak_rss_mb:>7.1f} MB (+{peak_rss_increase_mb:.1f})  {output_bytes:>9} bytes".format(
+        **result
+    )
+
+
+def compare(before_path, after_path):
+    """Prints p50, p95 and peak RSS changes between two results files."""
+    with open(before_path) as f:
+        before = {(r["case"], r["op"]): r for r in json.load(f)["results"]}
+    with open(after_path) as f:
+        after = {(r["case"], r["op"]): r for r in json.load(f)["results"]}
+
+    def change(key, b, a):
+        if "rejected" in b or "rejected" in a:
+            return "{:>8}".format("rejected")
+        if not b[key]:
+            return "{:>8}".format("-")
+        return "{:>+7.1f}%".format((a[key] - b[key]) / b[key] * 100)
+
+    print(
+        "{:<18} {:<18} {:>8} {:>8} {:>8} {:>8}".format(
+            "case", "op", "p50", "p95", "rss", "bytes"
+        )
+    )
+    for key in sorted(before.keys() & after.keys()):
+        b, a = before[key], after[key]
+        print(
+            "{:<18} {:<18} {} {} {} {}".format(
+                key[0],
+                key[1],
+                change("p50_ms", b, a),
+                change("p95_ms", b, a),
+                change("peak_rss_increase_mb", b, a),
+                change("output_bytes", b, a),
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"))
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--corpus-dir", default=os.path.join("benchmarks", ".corpus"))
+    parser.add_argument(
+        "--sizes",
+        type=lambda v: [float(s) if "." in s else int(s) for s in v.split(",")],
+        default=SIZES_MP,
+        help="comma separated sizes in megapixels",
+    )
+    parser.add_argument(
+        "--modes", type=lambda v: v.split(","), default=MODES, help="comma separated"
+    )
+    parser.add_argument(
+        "--ops", type=lambda v: v.split(","), default=OPS, help="comma separated"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run_benchmark(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Load test of the function handler.
+
+Replays a mix of info, thumbnail and fit API Gateway events against app.lambda_handler
+from concurrent threads (as server does), with local_s3 standing in for S3.
+Reports throughput, status codes and p50/p90/p99 latency, overall and per operation.
+
+The events are generated over the benchmark corpus (see bench_pipeline) in proportions of --mix
+or read from a JSON lines file of recorded events (--events), generated events can be saved for replays (--record).
+
+Usage:
+    python benchmarks/load_test.py --requests 500 --concurrency 8 --record events.jsonl
+    python benchmarks/load_test.py --events events.jsonl --concurrency 16 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from time import perf_counter, strftime
+from urllib.parse import quote_plus
+from bench_pipeline import (
+    THUMBNAILER_DIR,
+    CORPUS_BUCKET,
+    corpus_cases,
+    generate_corpus,
+    _percentile,
+)
+
+OPS = ["info", "thumbnail", "fit"]
+DEFAULT_MIX = dict(info=1, thumbnail=6, fit=3)
+LONG_EDGES = [150, 300, 600, 1200]
+FITS = [(100, 100), (200, 200), (400, 300)]
+FORMATS = ["jpeg", "webp"]
+PERCENTILES = [50, 90, 99]
+
+RESOURCES = dict(
+    info="/thumbnailer/info/{uri}",
+    thumbnail="/thumbnailer/thumbnail/{uri}/long-edge/{long_edge_pixels}",
+    fit="/thumbnailer/fit/{uri}/width/{width_pixels}/height/{height_pixels}",
+)
+
+
+def _parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        op, _, weight = item.partition("=")
+        if op not in OPS:
+            raise argparse.ArgumentTypeError("{} not in: {}".format(op, ", ".join(OPS)))
+        mix[op] = float(weight or 1)
+    return mix
+
+
+def generate_events(cases, mix, count, seed):
+    """Returns count API Gateway events of operations in proportions of mix."""
+    rnd = random.Random(seed)
+    ops = list(mix.keys())
+    weights = [mix[op] for op in ops]
+    events = []
+    for _ in range(count):
+        op = rnd.choices(ops, weights)[0]
+        uri = quote_plus("s3://{}/{}".format(CORPUS_BUCKET, rnd.choice(cases)["file"]))
+        params = dict(uri=uri)
+        if op == "thumbnail":
+            params["long_edge_pixels"] = str(rnd.choice(LONG_EDGES))
+        elif op == "fit":
+            width, height = rnd.choice(FITS)
+            params.update(width_pixels=str(width), height_pixels=str(height))
+        headers = {}
+        if op != "info":
+            headers["Accept"] = "image/{}".format(rnd.choice(FORMATS))
+        events.append(
+            dict(resource=RESOURCES[op], headers=headers, pathParameters=params)
+        )
+    return events
+
+
+def read_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_events(path, events):
+    with open(path, "w") as f:
+        for event in events:
+            f.write(json.dumps(event, sort_keys=True) + "\n")
+
+
+def run_load(args, events):
+    """Runs the events (in order) from args.concurrency threads, returns results."""
+    # configured before the handler modules are imported
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    os.environ.setdefault("AWS_XRAY_SDK_ENABLED", "false")
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+    os.environ.setdefault("METRICS_ENABLED", "0")
+    os.environ["S3_LOCAL_ROOT"] = args.corpus_dir
+    if args.derivative_cache:
+        os.environ["DERIVATIVE_CACHE_URI"] = "s3://{}/derivatives/".format(
+            CORPUS_BUCKET
+        )
+    sys.path.insert(0, THUMBNAILER_DIR)
+    with redirect_stdout(sys.stderr):
+        import app
+
+    samples = []
+    lock = threading.Lock()
+
+    def handle(event):
+        started = perf_counter()
+        response = app.lambda_handler(event, None)
+        duration = (perf_counter() - started) * 1000
+        with lock:
+            samples.append(
+                (app.event_operation(event), response["statusCode"], duration)
+            )
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(handle, events[: args.warmup]))
+        samples.clear()
+        started = perf_counter()
+        list(executor.map(handle, events[args.warmup :]))
+        elapsed = perf_counter() - started
+
+    from PIL import __version__ as pillow_version
+
+    return dict(
+        meta=dict(
+            time=strftime("%Y-%m-%dT%H:%M:%S%z"),
+            python=platform.python_version(),
+            pillow=pillow_version,
+            platform=platform.platform(),
+            cpu_count=os.cpu_count(),
+            concurrency=args.concurrency,
+            warmup=args.warmup,
+            derivative_cache=args.derivative_cache,
+        ),
+        total=_summary(samples, elapsed),
+        ops={
+            op: _summary([s for s in samples if s[0] == op], elapsed)
+            for op in sorted({s[0] for s in samples})
+        },
+    )
+
+
+def _summary(samples, elapsed):
+    durations = [duration for _, _, duration in samples]
+    statuses = {}
+    for _, status, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    summary = dict(
+        requests=len(samples),
+        throughput_rps=round(len(samples) / elapsed, 2) if elapsed else 0,
+        statuses=statuses,
+        max_ms=round(max(durations), 3) if durations else 0,
+    )
+    for percent in PERCENTILES:
+        summary["p{}_ms".format(percent)] = (
+            round(_percentile(durations, percent), 3) if durations else 0
+        )
+    return summary
+
+
+def _format_summary(name, summary):
+    return "{name:<10} {requests:>6} req {throughput_rps:>8.1f} req/s  p50 {p50_ms:>8.1f} ms  p90 {p90_ms:>8.1f} ms  p99 {p99_ms:>8.1f} ms  max {max_ms:>8.1f} ms  {statuses}".format(
+        name=name, **summary
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", help="JSON lines file with events to replay")
+    parser.add_argument("--record", help="JSON lines file to save generated events to")
+    parser.add_argument("--output", help="JSON file to save the results to")
+    parser.add_argument("--corpus-dir", default=os.path.join("benchmarks", ".corpus"))
+    parser.add_argument(
+        "--sizes",
+        type=lambda v: [float(s) if "." in s else int(s) for s in v.split(",")],
+        default=[0.3, 2, 12],
+        help="comma separated sizes in megapixels of the corpus images",
+    )
+    parser.add_argument(
+        "--mix",
+        type=_parse_mix,
+        default=DEFAULT_MIX,
+        help="comma separated operations with weights, e.g. info=1,thumbnail=6,fit=3",
+    )
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--warmup", type=int, default=0, help="first events not measured"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--derivative-cache",
+        action="store_true",
+        help="cache derivatives (in the corpus directory)",
+    )
+    args = parser.parse_args()
+
+    if args.events:
+        events = read_events(args.events)
+    else:
+        cases = corpus_cases(args.sizes, ["RGB"])
+        generate_corpus(args.corpus_dir, cases)
+        events = generate_events(
+            cases, args.mix, args.warmup + args.requests, args.seed
+        )
+        if args.record:
+            write_events(args.record, events)
+
+    results = run_load(args, events)
+    print(_format_summary("total", results["total"]), file=sys.stderr)
+    for op, summary in results["ops"].items():
+        print(_format_summary(op, summary), file=sys.stderr)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+Tests of the function modules (thumbnailer directory), run with:
+
+    python -m pytest tests
+
+S3 is stood in by local_s3 (in memory), X-Ray and metrics are disabled.
+"""
+
+import os
+import sys
+
+# configured before the function modules are imported
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("AWS_XRAY_SDK_ENABLED", "false")
+os.environ.setdefault("METRICS_ENABLED", "0")
+os.environ["S3_LOCAL_ROOT"] = "memory"
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "thumbnailer")
+)
+
+import pytest
+
+
+@pytest.fixture
+def s3():
+    """Returns S3 client (in memory) used by vfile.S3File, empty for each test."""
+    from local_s3 import LocalS3Client
+    from vfile import S3File, source_cache
+
+    client = LocalS3Client()
+    S3File.set_client(client)
+    yield client
+    for uri, _ in list(source_cache._entries.items()):
+        source_cache.remove(uri)
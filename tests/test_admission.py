@@ -0,0 +1,121 @@
+import pickle
+import threading
+from time import sleep
+from PIL import Image
+import pytest
+from admission import MemoryBudget, RenderRejectedException, estimate_memory
+
+MB = 1024 * 1024
+
+
+def _reserve_in_thread(budget, nbytes, admitted):
+    def reserve():
+        try:
+            budget.reserve(nbytes)
+            admitted.append(nbytes)
+        except RenderRejectedException as e:
+            admitted.append(e)
+
+    thread = threading.Thread(target=reserve)
+    thread.start()
+    return thread
+
+
+def _wait_for_waiting(budget, waiting):
+    for _ in range(100):
+        if budget.waiting == waiting:
+            return
+        sleep(0.01)
+    raise AssertionError("{} renders waiting".format(budget.waiting))
+
+
+def test_accepts_within_budget():
+    budget = MemoryBudget(10 * MB, queue_size=1, timeout=1)
+    budget.reserve(4 * MB)
+    budget.reserve(6 * MB)
+    assert budget.reserved == 10 * MB
+    assert budget.waiting == 0
+
+
+def test_release():
+    budget = MemoryBudget(10 * MB, queue_size=1, timeout=1)
+    budget.reserve(4 * MB)
+    budget.release(4 * MB)
+    assert budget.reserved == 0
+
+
+def test_waits_for_release():
+    budget = MemoryBudget(10 * MB, queue_size=1, timeout=5)
+    budget.reserve(8 * MB)
+    admitted = []
+    thread = _reserve_in_thread(budget, 4 * MB, admitted)
+    _wait_for_waiting(budget, 1)
+    assert admitted == []
+    budget.release(8 * MB)
+    thread.join()
+    assert admitted == [4 * MB]
+    assert budget.reserved == 4 * MB
+    assert budget.waiting == 0
+
+
+def test_admits_in_order():
+    budget = MemoryBudget(10 * MB, queue_size=2, timeout=5)
+    budget.reserve(8 * MB)
+    admitted = []
+    big = _reserve_in_thread(budget, 6 * MB, admitted)
+    _wait_for_waiting(budget, 1)
+    # would fit, but does not overtake the waiting one
+    small = _reserve_in_thread(budget, 1 * MB, admitted)
+    _wait_for_waiting(budget, 2)
+    budget.release(8 * MB)
+    big.join()
+    small.join()
+    assert admitted == [6 * MB, 1 * MB]
+
+
+def test_rejects_if_queue_full():
+    budget = MemoryBudget(10 * MB, queue_size=1, timeout=5)
+    budget.reserve(8 * MB)
+    admitted = []
+    thread = _reserve_in_thread(budget, 4 * MB, admitted)
+    _wait_for_waiting(budget, 1)
+    with pytest.raises(RenderRejectedException, match="1 renders waiting"):
+        budget.reserve(4 * MB)
+    budget.release(8 * MB)
+    thread.join()
+    assert admitted == [4 * MB]
+
+
+def test_rejects_on_timeout():
+    budget = MemoryBudget(10 * MB, queue_size=1, timeout=0.1)
+    budget.reserve(8 * MB)
+    with pytest.raises(RenderRejectedException, match="not available in 0.1s"):
+        budget.reserve(4 * MB)
+    assert budget.reserved == 8 * MB
+    assert budget.waiting == 0
+
+
+def test_bigger_than_budget_runs_alone():
+    budget = MemoryBudget(10 * MB, queue_size=1, timeout=0.1)
+    budget.reserve(20 * MB)
+    assert budget.reserved == 20 * MB
+    with pytest.raises(RenderRejectedException):
+        budget.reserve(1 * MB)
+
+
+def test_not_limited():
+    budget = MemoryBudget(0, queue_size=0, timeout=0)
+    budget.reserve(100 * MB)
+    budget.reserve(100 * MB)
+    budget.release(100 * MB)
+    assert budget.waiting == 0
+
+
+def test_rejected_exception_pickled():
+    e = pickle.loads(pickle.dumps(RenderRejectedException("1 renders waiting")))
+    assert str(e) == "Render rejected, 1 renders waiting"
+
+
+def test_estimate_memory():
+    assert estimate_memory(Image.new("L", (100, 10))) == 100 * 10 * 2
+    assert estimate_memory(Image.new("RGB", (100, 10))) == 100 * 10 * 4 * 2
@@ -0,0 +1,109 @@
+from io import BytesIO
+from PIL import Image
+import pytest
+from vfile import vfile
+import app
+
+ETAG = '"abc"'
+LAST_MODIFIED = "Wed, 21 Oct 2026 07:28:00 GMT"
+VALIDATORS = {"ETag": ETAG, "Last-Modified": LAST_MODIFIED}
+
+
+@pytest.mark.parametrize(
+    "headers, not_modified",
+    [
+        ({}, False),
+        ({"If-None-Match": ETAG}, True),
+        ({"if-none-match": ETAG}, True),
+        ({"If-None-Match": '"x", ' + ETAG}, True),
+        ({"If-None-Match": "W/" + ETAG}, True),
+        ({"If-None-Match": "*"}, True),
+        ({"If-None-Match": '"x"'}, False),
+        # If-None-Match takes precedence
+        ({"If-None-Match": '"x"', "If-Modified-Since": LAST_MODIFIED}, False),
+        (
+            {
+                "If-None-Match": ETAG,
+                "If-Modified-Since": "Tue, 20 Oct 2026 07:28:00 GMT",
+            },
+            True,
+        ),
+        # not evaluated if the derivative has ETag
+        ({"If-Modified-Since": LAST_MODIFIED}, False),
+    ],
+)
+def test_is_not_modified(headers, not_modified):
+    assert app.is_not_modified(headers, VALIDATORS) == not_modified
+
+
+@pytest.mark.parametrize(
+    "if_modified_since, not_modified",
+    [
+        (LAST_MODIFIED, True),
+        ("Thu, 22 Oct 2026 07:28:00 GMT", True),
+        ("Tue, 20 Oct 2026 07:28:00 GMT", False),
+        ("invalid", False),
+    ],
+)
+def test_is_not_modified_since(if_modified_since, not_modified):
+    validators = {"Last-Modified": LAST_MODIFIED}
+    headers = {"If-Modified-Since": if_modified_since}
+    assert app.is_not_modified(headers, validators) == not_modified
+
+
+@pytest.fixture
+def event(s3):
+    data = BytesIO()
+    Image.new("RGB", (400, 300), (200, 100, 50)).save(data, "JPEG")
+    vfile("s3://bucket/image.jpg").write(data.getvalue())
+    return {
+        "resource": "/thumbnailer/thumbnail/{uri}/long-edge/{long_edge_pixels}",
+        "headers": {},
+        "pathParameters": {
+            "uri": "s3%3A%2F%2Fbucket%2Fimage.jpg",
+            "long_edge_pixels": "200",
+        },
+    }
+
+
+def _get(event, headers):
+    return app.lambda_handler(dict(event, headers=headers), None)
+
+
+def test_not_modified_response(event):
+    response = _get(event, {})
+    assert response["statusCode"] == 200
+    etag = response["headers"]["ETag"]
+    last_modified = response["headers"]["Last-Modified"]
+
+    response = _get(event, {"If-None-Match": etag})
+    assert response["statusCode"] == 304
+    assert response["headers"]["ETag"] == etag
+    assert not response.get("body")
+
+    assert _get(event, {"If-Modified-Since": last_modified})["statusCode"] == 200
+    headers = {"If-None-Match": '"x"', "If-Modified-Since": last_modified}
+    assert _get(event, headers)["statusCode"] == 200
+
+
+def test_modified_with_other_settings(event):
+    etag = _get(event, {})["headers"]["ETag"]
+    response = _get(event, {"If-None-Match": etag, "Image-Preset": "best"})
+    assert response["statusCode"] == 200
+    assert response["headers"]["ETag"] != etag
+
+
+class _SourceWithoutValidators:
+    uri = "https://example.com/image.jpg"
+
+    def etag(self):
+        return None
+
+    def last_modified(self):
+        return None
+
+
+def test_no_validators_without_source_etag():
+    headers = app.validator_headers(_SourceWithoutValidators(), "thumbnail", (), {})
+    assert headers == {}
+    assert not app.is_not_modified({"If-None-Match": 'W/"-"'}, headers)
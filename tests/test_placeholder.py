@@ -0,0 +1,116 @@
+import math
+import numpy as np
+from PIL import Image
+import pytest
+from placeholder import blurhash, dominant_color, placeholder, _encode83
+
+
+def _gradient(width, height):
+    return np.array(
+        [[[x * 32, y * 40, 128] for x in range(width)] for y in range(height)],
+        dtype=np.uint8,
+    )
+
+
+def _solid(color):
+    return np.full((4, 4, 3), color, dtype=np.uint8)
+
+
+def _reference_blurhash(pixels, nx, ny):
+    """BlurHash as specified in https://github.com/woltapp/blurhash (per pixel loops)."""
+    height, width = pixels.shape[:2]
+
+    def to_linear(value):
+        value = value / 255
+        return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+    def to_srgb(value):
+        value = min(1.0, max(0.0, value))
+        if value <= 0.0031308:
+            return int(value * 12.92 * 255 + 0.5)
+        return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+    factors = []
+    for j in range(ny):
+        for i in range(nx):
+            normalisation = 1 if i == 0 and j == 0 else 2
+            factor = [0.0, 0.0, 0.0]
+            for y in range(height):
+                for x in range(width):
+                    basis = (
+                        normalisation
+                        * math.cos(math.pi * i * x / width)
+                        * math.cos(math.pi * j * y / height)
+                    )
+                    for c in range(3):
+                        factor[c] += basis * to_linear(pixels[y, x, c])
+            factors.append([value / (width * height) for value in factor])
+    dc, ac = factors[0], factors[1:]
+
+    result = _encode83((nx - 1) + (ny - 1) * 9, 1)
+    actual_max = max(abs(value) for factor in ac for value in factor)
+    quantised_max = int(max(0, min(82, math.floor(actual_max * 166 - 0.5))))
+    maximum = (quantised_max + 1) / 166
+    result += _encode83(quantised_max, 1)
+    result += _encode83(
+        (to_srgb(dc[0]) << 16) + (to_srgb(dc[1]) << 8) + to_srgb(dc[2]), 4
+    )
+    for factor in ac:
+        r, g, b = (
+            int(
+                max(
+                    0,
+                    min(
+                        18,
+                        math.floor(math.copysign(abs(v / maximum) ** 0.5, v) * 9 + 9.5),
+                    ),
+                )
+            )
+            for v in factor
+        )
+        result += _encode83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+@pytest.mark.parametrize(
+    "value, length, encoded",
+    [(0, 1, "0"), (82, 1, "~"), (83, 2, "10"), (0xFFFFFF, 4, "TSUA")],
+)
+def test_encode83(value, length, encoded):
+    assert _encode83(value, length) == encoded
+
+
+@pytest.mark.parametrize(
+    "pixels, components, expected",
+    [
+        # all the components 0 (quantised AC "fQ"), black is 0 also in linear RGB
+        (_solid((0, 0, 0)), (4, 3), "L00000fQfQfQfQfQfQfQfQfQfQfQ"),
+        (_solid((255, 255, 255)), (4, 3), "L~TSUA~qfQ~q~q%MfQ%MfQfQfQfQ"),
+        (_solid((255, 0, 0)), (4, 3), "L~TI:j|cfQ|c|c$5fQ$5fQfQfQfQ"),
+        (_gradient(8, 6), (4, 3), "LjF=ad3Ba|xuzONLfQnTeqf7fQf7"),
+        (_gradient(8, 6), (3, 3), "KjF=ad3Ba|zONLfQeqf7fQ"),
+    ],
+)
+def test_blurhash_known_vectors(pixels, components, expected):
+    assert blurhash(pixels, components) == expected
+    assert _reference_blurhash(pixels, *components) == expected
+
+
+def test_blurhash_as_reference():
+    pixels = np.random.default_rng(1).integers(0, 256, (12, 16, 3), dtype=np.uint8)
+    assert blurhash(pixels, (4, 3)) == _reference_blurhash(pixels, 4, 3)
+
+
+def test_dominant_color():
+    pixels = _solid((200, 100, 50))
+    pixels[0, 0] = (0, 0, 0)
+    assert dominant_color(pixels) == "#c86432"
+
+
+def test_placeholder():
+    im = Image.new("RGB", (32, 24), (200, 100, 50))
+    result = placeholder(im, (4000, 3000))
+    assert (result.width, result.height) == (4000, 3000)
+    assert len(result.blurhash) == 28
+    assert result.dominant_color == "#c86432"
+    assert result.preview.startswith("data:image/webp;base64,")
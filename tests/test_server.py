@@ -0,0 +1,52 @@
+import asyncio
+from server import Server
+
+BATCH_PATH = "/thumbnailer/batch/s3%3A%2F%2Fbucket%2Fimage.jpg"
+
+
+def _scope(path=BATCH_PATH, method="POST"):
+    return dict(type="http", method=method, path=path, headers=[])
+
+
+async def _request(server, scope, messages):
+    """Returns status of the response, messages are the request body parts (body, delay)."""
+    sent = []
+
+    async def receive():
+        body, delay = messages.pop(0)
+        await asyncio.sleep(delay)
+        return dict(type="http.request", body=body, more_body=bool(messages))
+
+    async def send(message):
+        sent.append(message)
+
+    await server(scope, receive, send)
+    return sent[0]["status"]
+
+
+def test_rejects_requests_receiving_body_if_overloaded():
+    async def run():
+        server = Server(workers=1, queue_size=1)
+        slow = [
+            asyncio.ensure_future(_request(server, _scope(), [(b"\xff", 0.2)]))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0.1)
+        assert server.pending == 2
+        assert await _request(server, _scope(), [(b"", 0)]) == 503
+        # invalid UTF-8
+        assert await asyncio.gather(*slow) == [400, 400]
+        assert server.pending == 0
+
+    asyncio.run(run())
+
+
+def test_rejects_requests_after_shutdown():
+    async def run():
+        server = Server(workers=1, queue_size=1)
+        server._start()
+        await server._stop()
+        assert await _request(server, _scope(), [(b"{}", 0)]) == 503
+        assert server._executor is None
+
+    asyncio.run(run())
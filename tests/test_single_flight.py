@@ -0,0 +1,126 @@
+import logging
+import threading
+from time import monotonic, sleep
+import pytest
+from vfile import vfile
+from single_flight import SingleFlight
+
+LOCK_URI_PREFIX = "s3://bucket/locks/"
+KEY = "thumbnail/abc"
+
+
+def _lock():
+    return vfile(LOCK_URI_PREFIX + KEY)
+
+
+@pytest.fixture
+def flight(s3):
+    return SingleFlight(LOCK_URI_PREFIX, timeout=1, poll_interval=0.01)
+
+
+def test_renders_once_with_lock(flight):
+    assert flight.run(KEY, lambda: None, lambda: "rendered") == "rendered"
+    # released after rendering
+    assert not _lock().exists()
+
+
+def test_releases_lock_if_render_fails(flight):
+    def render():
+        raise IOError("render failed")
+
+    with pytest.raises(IOError):
+        flight.run(KEY, lambda: None, render)
+    assert not _lock().exists()
+
+
+def test_concurrent_callers_in_process_render_once(flight):
+    rendered = []
+    result = []
+    started = threading.Event()
+
+    def render():
+        started.set()
+        sleep(0.1)
+        rendered.append(1)
+        result.append("rendered")
+        return "rendered"
+
+    def lookup():
+        return result[0] if result else None
+
+    threads = [
+        threading.Thread(target=flight.run, args=(KEY, lookup, render))
+        for _ in range(4)
+    ]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert rendered == [1]
+
+
+def test_waits_for_other_process(flight):
+    # acquired by another process, which stores the result
+    assert _lock().create(b"")
+    result = []
+    threading.Timer(0.1, lambda: result.append("stored")).start()
+    rendered = []
+
+    def render():
+        rendered.append(1)
+        return "rendered"
+
+    assert flight.run(KEY, lambda: result[0] if result else None, render) == "stored"
+    assert rendered == []
+    # the other process releases its lock
+    assert _lock().exists()
+
+
+def test_renders_if_lock_expires(flight):
+    # acquired by another process which is slow or crashed
+    assert _lock().create(b"")
+    started = monotonic()
+    assert flight.run(KEY, lambda: None, lambda: "rendered") == "rendered"
+    assert monotonic() - started >= 1
+    # the other process may still be rendering
+    assert _lock().exists()
+
+
+def test_removes_stale_lock(s3):
+    flight = SingleFlight(
+        LOCK_URI_PREFIX, timeout=0.1, poll_interval=0.01, lock_timeout=0
+    )
+    # acquired by another process which crashed
+    assert _lock().create(b"")
+    assert flight.run(KEY, lambda: None, lambda: "rendered") == "rendered"
+    assert not _lock().exists()
+
+
+def test_fails_on_invalid_lock(s3, monkeypatch):
+    def create(self, data, content_type=None):
+        raise TypeError("invalid parameter")
+
+    monkeypatch.setattr(type(_lock()), "create", create)
+    flight = SingleFlight(LOCK_URI_PREFIX)
+    with pytest.raises(TypeError):
+        flight.run(KEY, lambda: None, lambda: "rendered")
+
+
+def test_renders_if_lock_released_without_result(flight, caplog):
+    caplog.set_level(logging.WARNING)
+    # acquired by another process which failed to render
+    assert _lock().create(b"")
+    threading.Timer(0.1, _lock().remove).start()
+    started = monotonic()
+    assert flight.run(KEY, lambda: None, lambda: "rendered") == "rendered"
+    # not waiting for the timeout
+    assert monotonic() - started < 1
+    assert "released without result" in caplog.text
+    assert "Timed out" not in caplog.text
+
+
+def test_renders_without_locks(s3):
+    flight = SingleFlight(None)
+    assert flight.run(KEY, lambda: None, lambda: "rendered") == "rendered"
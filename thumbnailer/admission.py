@@ -0,0 +1,132 @@
+"""
+Admission of renders against a process-wide memory budget,
+so that a warm process (see server) runs many small renders at the same time
+but not so many big ones that it runs out of memory.
+
+Each render reserves memory estimated from the image header (see estimate_memory)
+before decoding, it waits in the queue if the budget is exhausted
+and it is rejected (RenderRejectedException) if the queue is full or it waits too long.
+Renders are admitted in the order they arrive, a render bigger than the whole budget runs alone.
+"""
+
+from os import getenv
+from time import monotonic
+from threading import Condition
+from collections import deque
+import metrics
+
+# memory (MB) for decoded images of all the renders, not limited if 0
+RENDER_MEMORY_BUDGET = int(getenv("RENDER_MEMORY_BUDGET", 0)) * 1024 * 1024
+# renders waiting for memory, others are rejected
+RENDER_QUEUE_SIZE = int(getenv("RENDER_QUEUE_SIZE", 16))
+# seconds a render waits for memory before it is rejected
+RENDER_QUEUE_TIMEOUT = float(getenv("RENDER_QUEUE_TIMEOUT", 10))
+# peak memory of a render relative to its decoded image,
+# covering conversion (see image_editor._convert_image) and resampled copies
+RENDER_MEMORY_FACTOR = float(getenv("RENDER_MEMORY_FACTOR", 2))
+
+# Pillow stores pixels of the modes with 1 band in 1 byte, of the other modes in 4 bytes
+_ONE_BYTE_MODES = ("1", "L", "P")
+
+
+class RenderRejectedException(Exception):
+    def __init__(self, reason):
+        message = "Render rejected, {reason}".format(reason=reason)
+        self._message = message
+        # all the arguments, so that it can be pickled (e.g. raised in multiprocessing worker)
+        super(RenderRejectedException, self).__init__(reason)
+
+    @property
+    def message(self):
+        return self._message
+
+    def __str__(self):
+        return self._message
+
+
+def estimate_memory(im):
+    """Returns peak memory (bytes) of rendering the image, not decoded yet (possibly drafted)."""
+    bytes_per_pixel = 1 if im.mode in _ONE_BYTE_MODES else 4
+    return int(im.width * im.height * bytes_per_pixel * RENDER_MEMORY_FACTOR)
+
+
+class MemoryBudget:
+    """Memory (bytes) reserved by the renders running at the same time."""
+
+    def __init__(
+        self,
+        budget=RENDER_MEMORY_BUDGET,
+        queue_size=RENDER_QUEUE_SIZE,
+        timeout=RENDER_QUEUE_TIMEOUT,
+    ):
+        self._budget = budget
+        self._queue_size = queue_size
+        self._timeout = timeout
+        self._condition = Condition()
+        self._reserved = 0
+        self._waiting = deque()
+
+    @property
+    def reserved(self):
+        return self._reserved
+
+    @property
+    def waiting(self):
+        return len(self._waiting)
+
+    def reserve(self, nbytes):
+        """Reserves nbytes, waiting (in order) for renders that reserved it before to release it.
+
+        Raises RenderRejectedException if the queue is full or nbytes are not available in time.
+        """
+        if self._budget <= 0:
+            return
+        with self._condition:
+            if not self._waiting and self._fits(nbytes):
+                self._reserved += nbytes
+                return
+            if len(self._waiting) >= self._queue_size:
+                metrics.put_metric("RenderRejected", 1, metrics.COUNT)
+                raise RenderRejectedException(
+                    "{} renders waiting".format(len(self._waiting))
+                )
+            ticket = object()
+            self._waiting.append(ticket)
+            metrics.put_metric("RenderQueueDepth", len(self._waiting), metrics.COUNT)
+            started = monotonic()
+            try:
+                while self._waiting[0] is not ticket or not self._fits(nbytes):
+                    remaining = started + self._timeout - monotonic()
+                    if remaining <= 0:
+                        metrics.put_metric("RenderRejected", 1, metrics.COUNT)
+                        raise RenderRejectedException(
+                            "{} bytes not available in {}s".format(
+                                nbytes, self._timeout
+                            )
+                        )
+                    self._condition.wait(remaining)
+                self._reserved += nbytes
+            finally:
+                self._waiting.remove(ticket)
+                # the next one may fit now
+                self._condition.notify_all()
+                metrics.put_metric(
+                    "RenderQueueTime",
+                    (monotonic() - started) * 1000,
+                    metrics.MILLISECONDS,
+                )
+
+    def release(self, nbytes):
+        if self._budget <= 0:
+            return
+        with self._condition:
+            self._reserved -= nbytes
+            self._condition.notify_all()
+
+    def _fits(self, nbytes):
+        # too big for the budget, it runs alone
+        return self._reserved == 0 or self._reserved + nbytes <= self._budget
+
+
+# shared by all the renders of the process
+RENDER_BUDGET = MemoryBudget()
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Optional
 from pydantic import BaseModel, ValidationError
 
 
@@ -6,3 +6,6 @@ class ApiEvent(BaseModel):
     resource: str
     headers: Dict[str, str]
     pathParameters: Dict[str, str]
+    body: Optional[str] = None
+    # body of binary media types (see BinaryMediaTypes in template.yaml) is base64 encoded
+    isBase64Encoded: bool = False
@@ -1,28 +1,432 @@
+# imported first to measure the initialization time
+from config import (
+    handle_error,
+    put_annotation,
+    log_init_time,
+    CONTENT_AGE_IN_SECONDS,
+    INLINE_RESPONSE_MAX_SIZE,
+)
+from os import getenv
 from api_event_type import ApiEvent, ValidationError
+from batch_event_type import BatchRequest, BatchEvent
 from response_types import (
     JSONResultResponse,
     BinaryResultResponse,
+    SeeOtherResponse,
+    FoundResponse,
+    NotModifiedResponse,
     ServerErrorResponse,
     BadRequestResponse,
     NotFoundResponse,
     ForbiddenResponse,
+    UnprocessableEntityResponse,
+    BadGatewayResponse,
+    ServiceUnavailableResponse,
 )
 from urllib.parse import unquote_plus
-from config import handle_error, put_annotation, CONTENT_AGE_IN_SECONDS
-from vfile import S3File, InvalidURIException, NotFoundException, ForbiddenException
-from image_editor import get_size_image_data, resize_image_data, fit_image_data
+from json import loads as json_loads
+from base64 import b64decode
+from email.utils import format_datetime, parsedate_to_datetime
+from vfile import (
+    vfile,
+    S3File,
+    HttpFile,
+    InvalidURIException,
+    NotFoundException,
+    ForbiddenException,
+    TooLargeException,
+    RedirectException,
+    UpstreamException,
+)
+from image_editor import (
+    ImageEditor,
+    placeholder_image_data,
+    placeholder_settings,
+    output_format_name,
+    crop_strategy_name,
+    DEFAULT_CROP_STRATEGY,
+    negotiate_output_format,
+    content_type,
+    file_extension,
+    ImageTooLargeException,
+    check_input_size,
+)
+from prerender import records_handler
+from derivative_cache import (
+    derivative_cache,
+    derivative_key,
+    DERIVATIVE_CACHE_URL,
+    PRESIGNED_URL_EXPIRES_IN,
+)
+from image_info import probe_image_info
+from admission import RenderRejectedException
+import size_buckets
+import metrics
 import logging
 from aws_xray_sdk.core import xray_recorder
 
 INFO_RESOURCE_PREFIX = "/thumbnailer/info/"
 THUMBNAIL_RESOURCE_PREFIX = "/thumbnailer/thumbnail/"
 FIT_RESOURCE_PREFIX = "/thumbnailer/fit/"
+BATCH_RESOURCE_PREFIX = "/thumbnailer/batch/"
+PLACEHOLDER_RESOURCE_PREFIX = "/thumbnailer/placeholder/"
+
+# (method, resource) of the API, the same as in template.yaml, see match_resource
+API_RESOURCES = [
+    ("GET", "/thumbnailer/info/{uri}"),
+    ("GET", "/thumbnailer/placeholder/{uri}"),
+    ("GET", "/thumbnailer/thumbnail/{uri}/long-edge/{long_edge_pixels}"),
+    (
+        "GET",
+        "/thumbnailer/thumbnail/{uri}/long-edge/{long_edge_pixels}/format/{format}",
+    ),
+    ("GET", "/thumbnailer/fit/{uri}/width/{width_pixels}/height/{height_pixels}"),
+    (
+        "GET",
+        "/thumbnailer/fit/{uri}/width/{width_pixels}/height/{height_pixels}/format/{format}",
+    ),
+    (
+        "GET",
+        "/thumbnailer/fit/{uri}/width/{width_pixels}/height/{height_pixels}/crop/{crop}",
+    ),
+    (
+        "GET",
+        "/thumbnailer/fit/{uri}/width/{width_pixels}/height/{height_pixels}/crop/{crop}/format/{format}",
+    ),
+    ("POST", "/thumbnailer/batch/{uri}"),
+]
 
 URI_PREFIX_HEADER = "Uri-Prefix"
-CONTENT_HEADERS = {"Cache-Control": "max-age={0}".format(CONTENT_AGE_IN_SECONDS)}
+ACCEPT_HEADER = "Accept"
+IF_NONE_MATCH_HEADER = "If-None-Match"
+IF_MODIFIED_SINCE_HEADER = "If-Modified-Since"
+# image editor preset (see image_editor.PRESETS), the deployment one (IMAGE_PRESET) if not set
+PRESET_HEADER = "Image-Preset"
+CONTENT_HEADERS = {
+    "Cache-Control": "max-age={0}".format(CONTENT_AGE_IN_SECONDS),
+    "Vary": PRESET_HEADER,
+}
+# the content depends on Accept header if the format is not in the path
+NEGOTIATED_CONTENT_HEADERS = dict(
+    CONTENT_HEADERS, Vary="{}, {}".format(ACCEPT_HEADER, PRESET_HEADER)
+)
+
+# placeholders (see placeholder) do not depend on the preset
+PLACEHOLDER_HEADERS = {
+    "Cache-Control": "max-age={0}".format(CONTENT_AGE_IN_SECONDS),
+    "Content-Type": "application/json",
+}
+# placeholder embedded in /info response, it reads the whole image, not only its header
+INFO_PLACEHOLDER = getenv("INFO_PLACEHOLDER", "0") != "0"
+
+# presigned URLs must not be cached longer than they are valid
+REDIRECT_HEADERS = {
+    "Cache-Control": "max-age={0}".format(
+        CONTENT_AGE_IN_SECONDS
+        if DERIVATIVE_CACHE_URL
+        else min(CONTENT_AGE_IN_SECONDS, PRESIGNED_URL_EXPIRES_IN // 2)
+    )
+}
+
+DERIVATIVE_CACHE = derivative_cache()
+
+# seconds a client should wait before retrying render rejected when overloaded (see admission)
+RENDER_RETRY_AFTER = int(getenv("RENDER_RETRY_AFTER", 1))
+
+# batch results can be written only under these (comma separated) URI prefixes
+BATCH_TARGET_URI_PREFIXES = [
+    prefix for prefix in getenv("BATCH_TARGET_URI_PREFIXES", "").split(",") if prefix
+]
+
+# source images can be read only under these (comma separated) URI prefixes,
+# e.g. "s3://,https://images.example.com/" allows any S3 bucket and one HTTP(S) origin
+SOURCE_URI_PREFIXES = [
+    prefix for prefix in getenv("SOURCE_URI_PREFIXES", "s3://").split(",") if prefix
+]
+
+for prefix in SOURCE_URI_PREFIXES + BATCH_TARGET_URI_PREFIXES:
+    # e.g. https://images.example.com would allow https://images.example.com.evil.org/
+    if not prefix.endswith("/"):
+        raise ValueError("URI prefix {} does not end with /".format(prefix))
+
+# create S3 client during the initialization, not when handling the first request
+S3File.init_client()
+if any(HttpFile.isHttpURI(prefix) for prefix in SOURCE_URI_PREFIXES):
+    HttpFile.init_pool()
+
+
+def get_header(headers, name):
+    """Returns value of the header (case insensitive) or None if not present."""
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def request_body(event):
+    """Returns the request body (str) of ApiEvent, decoded if base64 encoded by API Gateway.
+
+    Raises ValueError if the body is not valid base64 or UTF-8.
+    """
+    if not event.body:
+        return ""
+    if event.isBase64Encoded:
+        return b64decode(event.body, validate=True).decode("utf-8")
+    return event.body
+
+
+def match_resource(method, path):
+    """Returns (resource, path parameters) of API_RESOURCES matching the request,
+    as API Gateway does, or None if there is no match.
+
+    The path is not URL decoded, the parameters are not either.
+    """
+    segments = path.split("/")
+    for resource_method, resource in API_RESOURCES:
+        resource_segments = resource.split("/")
+        if resource_method != method.upper() or len(resource_segments) != len(segments):
+            continue
+        parameters = {}
+        for resource_segment, segment in zip(resource_segments, segments):
+            if resource_segment.startswith("{") and resource_segment.endswith("}"):
+                if not segment:
+                    break
+                parameters[resource_segment[1:-1]] = segment
+            elif resource_segment != segment:
+                break
+        else:
+            return resource, parameters
+    return None
+
+
+def source_file(uri):
+    """Returns the source image (VFile, see vfile).
+
+    Raises InvalidURIException if the URI is not allowed (see SOURCE_URI_PREFIXES).
+    """
+    if not any(uri.startswith(prefix) for prefix in SOURCE_URI_PREFIXES):
+        raise InvalidURIException(uri, " or ".join(SOURCE_URI_PREFIXES))
+    return vfile(uri)
+
+
+def validator_headers(source, operation, params, settings):
+    """Returns ETag and Last-Modified headers of the derivative, reading only metadata of the source.
+
+    The ETag is derived from the source ETag, the operation with its parameters and settings
+    (e.g. encoder settings of the editor), as the derivative cache key (see derivative_key).
+    No headers are returned if the source has no ETag (see VFile.etag).
+    """
+    etag = source.etag()
+    if etag is None:
+        return {}
+    key = derivative_key(source.uri, etag, operation, params, settings)
+    headers = {"ETag": '"{}"'.format(key.rpartition("/")[2])}
+    last_modified = source.last_modified()
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return headers
+
+
+def is_not_modified(headers, validators):
+    """Returns True if the request (headers) is conditional
+    and the derivative (validators, see validator_headers) has not been modified.
+
+    If-None-Match takes precedence over If-Modified-Since,
+    which is not evaluated if the derivative has ETag: Last-Modified is of the source,
+    the derivative also changes with the render parameters and settings (e.g. the output format or preset)
+    covered only by the ETag.
+
+    See https://tools.ietf.org/html/rfc7232#section-6
+    """
+    if_none_match = get_header(headers, IF_NONE_MATCH_HEADER)
+    if if_none_match is not None:
+        etags = [etag.strip() for etag in if_none_match.split(",")]
+        # weak comparison
+        etags = [etag[2:] if etag.startswith("W/") else etag for etag in etags]
+        return "*" in etags or validators.get("ETag") in etags
+    if "ETag" in validators:
+        return False
+    if_modified_since = get_header(headers, IF_MODIFIED_SINCE_HEADER)
+    if if_modified_since is not None and "Last-Modified" in validators:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since is None or since.tzinfo is None:
+            return False
+        modified = parsedate_to_datetime(validators["Last-Modified"])
+        return modified <= since
+    return False
+
+
+def render(source, operation, params, output_format, editor, render_data):
+    """Renders derivative of the source with the editor, using the derivative cache if configured.
+
+    render_data is called with the source opened for reading (see VFile.open).
+
+    Raises ImageTooLargeException if the source exceeds INPUT_SIZE_MAX, before it is read.
+
+    Returns (key, data) tuple, key of the derivative in the cache or None if not cached.
+    """
+    check_input_size(source.size())
+    if DERIVATIVE_CACHE is None:
+        return None, render_data(source.open())
+    return DERIVATIVE_CACHE.render(
+        source,
+        operation,
+        params,
+        editor.encoder_settings(output_format),
+        render_data,
+        content_type=content_type(output_format),
+    )
+
+
+def render_placeholder(source):
+    """Returns placeholder (dict, see placeholder.Placeholder) of the source,
+    using the derivative cache if configured.
+
+    Raises ImageTooLargeException if the source exceeds INPUT_SIZE_MAX, before it is read.
+    """
+    check_input_size(source.size())
+
+    def render_data(data):
+        return placeholder_image_data(data).json().encode("utf-8")
+
+    if DERIVATIVE_CACHE is None:
+        data = render_data(source.open())
+    else:
+        _, data = DERIVATIVE_CACHE.render(
+            source,
+            "placeholder",
+            (),
+            placeholder_settings(),
+            render_data,
+            content_type="application/json",
+        )
+    return json_loads(data)
+
+
+def bucket_redirect(event, bucketed):
+    """Snaps the requested size to its bucket (see size_buckets).
+
+    Returns redirect response to the bucketed size (if SIZE_BUCKET_MODE is redirect)
+    or None if the bucketed size should be rendered.
+    """
+    location = size_buckets.canonical_location(
+        event.resource, event.pathParameters, bucketed
+    )
+    if location is None:
+        return None
+    metrics.set_property("SizeBucket", size_buckets.SIZE_BUCKET_MODE)
+    if size_buckets.SIZE_BUCKET_MODE != "redirect":
+        return None
+    logging.info("Redirecting to bucketed size {}".format(location))
+    # not permanent, so that the clients follow changes of the buckets once the redirect expires
+    return FoundResponse(location, headers=CONTENT_HEADERS).dict()
+
+
+def binary_response(key, data, output_format, headers):
+    """Returns response with the data or redirect to the cached data if it is too big."""
+    metrics.put_metric("OutputBytes", len(data), metrics.BYTES)
+    if len(data) > INLINE_RESPONSE_MAX_SIZE:
+        if key is not None:
+            logging.info("Redirecting to {} ({} bytes)".format(key, len(data)))
+            location = DERIVATIVE_CACHE.url(key)
+            redirect_headers = dict(headers, **REDIRECT_HEADERS)
+            return SeeOtherResponse(location, headers=redirect_headers).dict()
+        logging.warning("Returning {} bytes, not cached".format(len(data)))
+    return BinaryResultResponse(
+        data=data, content_type=content_type(output_format), headers=headers
+    ).dict()
+
+
+def render_batch(uri, request):
+    """Renders all the sizes of the batch request and writes them under the target prefix.
+
+    Raises InvalidURIException if the target is not allowed.
+    Raises ImageTooLargeException if the source exceeds INPUT_SIZE_MAX, before it is read.
+
+    Returns dict with URIs and sizes (in bytes) of the written images.
+    """
+    target = request.target
+    if not any(target.startswith(prefix) for prefix in BATCH_TARGET_URI_PREFIXES):
+        raise InvalidURIException(target, " or ".join(BATCH_TARGET_URI_PREFIXES))
+    output_format = output_format_name(request.format)
+    editor = ImageEditor.preset(request.preset)
+    source = source_file(uri)
+    check_input_size(source.size())
+    data = source.read()
+    resized, fitted = editor.batch(
+        data, request.long_edges, request.fits, output_format=output_format
+    )
+    del data
+    extension = file_extension(output_format)
+    outputs = [
+        ("{}long-edge-{}.{}".format(target, long_edge_pixels, extension), thumb_data)
+        for long_edge_pixels, thumb_data in zip(request.long_edges, resized)
+    ] + [
+        ("{}fit-{}x{}.{}".format(target, width, height, extension), thumb_data)
+        for (width, height), thumb_data in zip(request.fits, fitted)
+    ]
+    for output_uri, thumb_data in outputs:
+        output_content_type = content_type(output_format)
+        if not vfile(output_uri).write(thumb_data, content_type=output_content_type):
+            raise IOError("Failed writing to {}".format(output_uri))
+    return dict(
+        uri=uri,
+        outputs=[
+            dict(uri=output_uri, size=len(thumb_data))
+            for output_uri, thumb_data in outputs
+        ],
+    )
+
+
+def invoke_handler(event, context):
+    """Handles direct invocation (not from API Gateway) with BatchEvent."""
+    try:
+        event = BatchEvent(**event)
+        logging.info("BatchEvent: {}".format(event.dict()))
+        put_annotation("uri", event.uri)
+        return render_batch(event.uri, event)
+    except Exception as e:
+        handle_error(e)
+        raise
+
+
+def event_operation(event):
+    """Returns name of the operation handling the event, used as metrics dimension."""
+    if "resource" not in event:
+        return "invoke"
+    resource = event["resource"]
+    for prefix in (
+        INFO_RESOURCE_PREFIX,
+        PLACEHOLDER_RESOURCE_PREFIX,
+        THUMBNAIL_RESOURCE_PREFIX,
+        FIT_RESOURCE_PREFIX,
+        BATCH_RESOURCE_PREFIX,
+    ):
+        if resource.startswith(prefix):
+            return prefix.strip("/").split("/")[-1]
+    return "unknown"
 
 
 def lambda_handler(event, context):
+    if "Records" in event:
+        # metrics are emitted for each record, see prerender
+        return records_handler(event)
+    request_metrics = metrics.begin_request(event_operation(event))
+    try:
+        if "resource" not in event:
+            return invoke_handler(event, context)
+        response = api_handler(event)
+        request_metrics.set_property("StatusCode", response["statusCode"])
+        return response
+    finally:
+        metrics.end_request()
+
+
+def api_handler(event):
     try:
         event = ApiEvent(**event)
         logging.info("ApiEvent: {}".format(event.dict()))
@@ -30,7 +434,7 @@ def lambda_handler(event, context):
             xray_recorder.begin_subsegment("parse_parameters")
             uri_encoded = event.pathParameters["uri"]
             uri = unquote_plus(uri_encoded)
-            uri_prefix = event.headers.get(URI_PREFIX_HEADER) or ""
+            uri_prefix = get_header(event.headers, URI_PREFIX_HEADER) or ""
             logging.info("{}: {}".format(URI_PREFIX_HEADER, uri_prefix))
             uri = "{}{}".format(uri_prefix, uri)
             logging.info("URI: {}".format(uri))
@@ -38,14 +442,32 @@ def lambda_handler(event, context):
             put_annotation("uri_encoded", uri_encoded)
             put_annotation(URI_PREFIX_HEADER, uri_prefix)
             put_annotation("resource", event.resource)
+            if "format" in event.pathParameters:
+                output_format = output_format_name(event.pathParameters["format"])
+                headers = CONTENT_HEADERS
+            else:
+                accept = get_header(event.headers, ACCEPT_HEADER)
+                output_format = negotiate_output_format(accept)
+                headers = NEGOTIATED_CONTENT_HEADERS
+            put_annotation("format", output_format)
+            editor = ImageEditor.preset(get_header(event.headers, PRESET_HEADER))
+            put_annotation("preset", editor.name)
             if event.resource.startswith(INFO_RESOURCE_PREFIX):
                 # TODO: pointer to function
                 pass
+            elif event.resource.startswith(PLACEHOLDER_RESOURCE_PREFIX):
+                pass
             elif event.resource.startswith(THUMBNAIL_RESOURCE_PREFIX):
                 long_edge_pixels = int(event.pathParameters["long_edge_pixels"])
             elif event.resource.startswith(FIT_RESOURCE_PREFIX):
                 width_pixels = int(event.pathParameters["width_pixels"])
                 height_pixels = int(event.pathParameters["height_pixels"])
+                crop = crop_strategy_name(
+                    event.pathParameters.get("crop", DEFAULT_CROP_STRATEGY)
+                )
+                put_annotation("crop", crop)
+            elif event.resource.startswith(BATCH_RESOURCE_PREFIX):
+                batch_request = BatchRequest.parse_raw(request_body(event))
             else:
                 assert False
         except KeyError:
@@ -57,29 +479,103 @@ def lambda_handler(event, context):
         # division_by_zero = 1 / 0
 
         if event.resource.startswith(INFO_RESOURCE_PREFIX):
-            data = S3File(uri).read()
-            image_size = get_size_image_data(data)
-            info = dict(
-                uri=uri,
-                uri_encoded=uri_encoded,
-                width=image_size[0],
-                height=image_size[1],
-            )
+            source = source_file(uri)
+            image_info = probe_image_info(source)
+            info = dict(uri=uri, uri_encoded=uri_encoded, **image_info.dict())
+            if INFO_PLACEHOLDER:
+                info["placeholder"] = render_placeholder(source)
             return JSONResultResponse(body=info).dict()
 
+        elif event.resource.startswith(PLACEHOLDER_RESOURCE_PREFIX):
+            source = source_file(uri)
+            headers = dict(
+                PLACEHOLDER_HEADERS,
+                **validator_headers(source, "placeholder", (), placeholder_settings())
+            )
+            if is_not_modified(event.headers, headers):
+                return NotModifiedResponse(headers=headers).dict()
+            placeholder = render_placeholder(source)
+            body = dict(uri=uri, uri_encoded=uri_encoded, **placeholder)
+            return JSONResultResponse(body=body, headers=headers).dict()
+
         elif event.resource.startswith(THUMBNAIL_RESOURCE_PREFIX):
-            data = S3File(uri).read()
-            thumb_data = resize_image_data(data, long_edge_pixels)
-            return BinaryResultResponse(
-                data=thumb_data, content_type="image/jpg", headers=CONTENT_HEADERS
-            ).dict()
+            if size_buckets.enabled():
+                bucketed = dict(
+                    long_edge_pixels=size_buckets.bucket_long_edge(long_edge_pixels)
+                )
+                response = bucket_redirect(event, bucketed)
+                if response is not None:
+                    return response
+                long_edge_pixels = bucketed["long_edge_pixels"]
+            source = source_file(uri)
+            params = (long_edge_pixels,)
+            headers = dict(
+                headers,
+                **validator_headers(
+                    source,
+                    "thumbnail",
+                    params,
+                    editor.encoder_settings(output_format),
+                )
+            )
+            if is_not_modified(event.headers, headers):
+                return NotModifiedResponse(headers=headers).dict()
+            key, thumb_data = render(
+                source,
+                "thumbnail",
+                params,
+                output_format,
+                editor,
+                lambda data: editor.resize(
+                    data, long_edge_pixels, output_format=output_format
+                ),
+            )
+            return binary_response(key, thumb_data, output_format, headers)
 
         elif event.resource.startswith(FIT_RESOURCE_PREFIX):
-            data = S3File(uri).read()
-            thumb_data = fit_image_data(data, width_pixels, height_pixels)
-            return BinaryResultResponse(
-                data=thumb_data, content_type="image/jpg", headers=CONTENT_HEADERS
-            ).dict()
+            if size_buckets.enabled():
+                bucketed = dict(
+                    zip(
+                        ("width_pixels", "height_pixels"),
+                        size_buckets.bucket_fit(width_pixels, height_pixels),
+                    )
+                )
+                response = bucket_redirect(event, bucketed)
+                if response is not None:
+                    return response
+                width_pixels = bucketed["width_pixels"]
+                height_pixels = bucketed["height_pixels"]
+            source = source_file(uri)
+            params = (width_pixels, height_pixels)
+            if crop != DEFAULT_CROP_STRATEGY:
+                params = params + (crop,)
+            headers = dict(
+                headers,
+                **validator_headers(
+                    source, "fit", params, editor.encoder_settings(output_format)
+                )
+            )
+            if is_not_modified(event.headers, headers):
+                return NotModifiedResponse(headers=headers).dict()
+            key, thumb_data = render(
+                source,
+                "fit",
+                params,
+                output_format,
+                editor,
+                lambda data: editor.fit(
+                    data,
+                    width_pixels,
+                    height_pixels,
+                    output_format=output_format,
+                    crop=crop,
+                ),
+            )
+            return binary_response(key, thumb_data, output_format, headers)
+
+        elif event.resource.startswith(BATCH_RESOURCE_PREFIX):
+            result = render_batch(uri, batch_request)
+            return JSONResultResponse(body=result).dict()
 
         assert False
     except (ValidationError, InvalidURIException, ValueError) as e:
@@ -91,6 +587,23 @@ def lambda_handler(event, context):
     except ForbiddenException as e:
         handle_error(e)
         return ForbiddenResponse().dict()
+    except ImageTooLargeException as e:
+        handle_error(e)
+        return UnprocessableEntityResponse().dict()
+    except (TooLargeException, RedirectException) as e:
+        # the source is not usable, not an error of the function
+        logging.warning(e.message)
+        return UnprocessableEntityResponse().dict()
+    except UpstreamException as e:
+        logging.warning(e.message)
+        return BadGatewayResponse().dict()
+    except RenderRejectedException as e:
+        # shedding load, not an error
+        logging.warning(e.message)
+        return ServiceUnavailableResponse(RENDER_RETRY_AFTER).dict()
     except Exception as e:
         handle_error(e)
         return ServerErrorResponse().dict()
+
+
+log_init_time(__name__)
@@ -0,0 +1,15 @@
+from typing import List, Optional, Tuple
+from pydantic import BaseModel, ValidationError
+
+
+class BatchRequest(BaseModel):
+    target: str
+    long_edges: List[int] = []
+    fits: List[Tuple[int, int]] = []
+    format: str = "jpeg"
+    # image editor preset, see image_editor.PRESETS
+    preset: Optional[str] = None
+
+
+class BatchEvent(BatchRequest):
+    uri: str
@@ -1,27 +1,35 @@
 from os import getenv
+from time import perf_counter
+
+# start of the function initialization (cold start), see log_init_time
+INIT_STARTED = perf_counter()
 
 try:
     with open("./version") as f:
         VER = f.read().rstrip()
 except FileNotFoundError:
-    version = "?"
+    VER = "?"
 RELEASE = "thumbnailer-{}".format(VER)
-print("RELEASE: {}".format(RELEASE))
 ENV = getenv("ENV", "DEV")
 LOCAL_ENV = ENV.lower() == "LOCAL".lower()
-print("ENV: {}".format(ENV))
-print("LOCAL_ENV: {}".format(LOCAL_ENV))
+print("RELEASE: {}, ENV: {}, LOCAL_ENV: {}".format(RELEASE, ENV, LOCAL_ENV))
 
 LOG_LEVEL = getenv("LOG_LEVEL", "ERROR")
 
 # see http://docs.aws.amazon.com/AmazonCloudFront/latest/DeveloperGuide/Expiration.html#expiration-individual-objects
 CONTENT_AGE_IN_SECONDS = int(getenv("CONTENT_AGE_IN_SECONDS", 10 * 60))
 
+# bigger results are not returned in the response but redirected to (if cached),
+# see https://docs.aws.amazon.com/lambda/latest/dg/gettingstarted-limits.html
+# the limit of 6 MB applies to base64 encoded data which is 4/3 bigger
+INLINE_RESPONSE_MAX_SIZE = int(getenv("INLINE_RESPONSE_MAX_SIZE", 4 * 1024 * 1024))
+
 # X-Ray integration
 
-from aws_xray_sdk.core import patch_all, xray_recorder
+from aws_xray_sdk.core import patch, xray_recorder
 
-patch_all()
+# only S3 calls are traced, patch_all imports (and patches) all the supported libraries
+patch(["botocore"])
 
 
 def put_annotation(key: str, value: str):
@@ -33,10 +41,10 @@ def put_annotation(key: str, value: str):
 # Sentry integration
 
 SENTRY_DSN = getenv("SENTRY_DSN")
+# sentry_sdk is imported only if enabled
+SENTRY_ENABLED = bool(SENTRY_DSN and SENTRY_DSN.startswith("https://"))
 
-from sentry_sdk import capture_exception
-
-if SENTRY_DSN and SENTRY_DSN.startswith("https://"):
+if SENTRY_ENABLED:
     print("SENTRY_DSN: {}".format(SENTRY_DSN))
     import sentry_sdk
     from sentry_sdk.integrations.aws_lambda import AwsLambdaIntegration
@@ -62,4 +70,11 @@ def handle_error(exception, message=None):
         logging.warning(f"{message}: {exception}", exc_info=True)
     else:
         logging.warning(f"Error: {exception}", exc_info=True)
-    capture_exception(exception)
+    if SENTRY_ENABLED:
+        sentry_sdk.capture_exception(exception)
+
+
+def log_init_time(name):
+    """Logs time since the start of the initialization, call at the end of the handler module."""
+    init_time = (perf_counter() - INIT_STARTED) * 1000
+    logging.info("{} initialized in {:.0f} ms".format(name, init_time))
@@ -0,0 +1,106 @@
+"""
+Chooses the crop window of fitted images (see image_editor.fit_image_data)
+with an energy map of a small proxy of the image.
+
+The window spans the whole image in one dimension and slides in the other one,
+its position maximizing the energy is found with cumulative sums,
+the result depends only on the pixels (it is deterministic).
+"""
+
+import numpy as np
+from PIL import Image
+
+# long edge of the proxy image the energy is computed of
+CROP_PROXY_SIZE = 128
+# gray levels of the histograms used by entropy strategy
+ENTROPY_BINS = 32
+
+
+def crop_centering(im, size, strategy):
+    """Returns centering (see PIL.ImageOps.fit) of the window of the image
+    with aspect ratio of size (width, height) chosen by strategy (entropy or attention).
+    """
+    proxy = _proxy_image(im)
+    pixels = np.asarray(proxy, dtype=np.float32) / 255.0
+    height, width = pixels.shape[:2]
+    if width * size[1] > height * size[0]:
+        # wider than requested, the window slides horizontally
+        axis, extent = 1, width
+        window = max(1, round(height * size[0] / size[1]))
+    else:
+        axis, extent = 0, height
+        window = max(1, round(width * size[1] / size[0]))
+    if window >= extent:
+        return 0.5, 0.5
+    if strategy == "entropy":
+        scores = _entropy_scores(pixels, axis, window)
+    elif strategy == "attention":
+        scores = _window_sums(_attention_energy(pixels).sum(axis=1 - axis), window)
+    else:
+        raise ValueError("Unknown crop strategy {}".format(strategy))
+    offset = _best_offset(scores)
+    position = offset / (extent - window)
+    return (position, 0.5) if axis == 1 else (0.5, position)
+
+
+def _proxy_image(im):
+    if im.mode not in ("RGB", "RGBA", "L", "LA"):
+        im = im.convert("RGB")
+    scale = CROP_PROXY_SIZE / max(im.size)
+    if scale < 1:
+        proxy_size = (max(1, round(im.width * scale)), max(1, round(im.height * scale)))
+        im = im.resize(proxy_size, resample=Image.BOX)
+    return im.convert("RGB")
+
+
+def _window_sums(values, window):
+    """Returns sums of values (1d) in all the positions of the window."""
+    cumsum = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    return cumsum[window:] - cumsum[:-window]
+
+
+def _best_offset(scores):
+    """Returns offset with the highest score, the closest to the centre of many."""
+    best = np.flatnonzero(scores >= scores.max() - 1e-6 * abs(scores.max()))
+    centre = (len(scores) - 1) / 2
+    return int(best[np.argmin(np.abs(best - centre))])
+
+
+def _luminance(pixels):
+    return pixels[..., 0] * 0.299 + pixels[..., 1] * 0.587 + pixels[..., 2] * 0.114
+
+
+def _entropy_scores(pixels, axis, window):
+    """Returns Shannon entropy of gray levels in all the positions of the window."""
+    levels = np.minimum(
+        (_luminance(pixels) * ENTROPY_BINS).astype(np.intp), ENTROPY_BINS - 1
+    )
+    if axis == 0:
+        levels = levels.T
+    # histograms of the lines (columns or rows) along the sliding axis
+    lines = levels.shape[1]
+    index = np.arange(lines, dtype=np.intp) * ENTROPY_BINS + levels
+    histograms = np.bincount(index.ravel(), minlength=lines * ENTROPY_BINS).reshape(
+        lines, ENTROPY_BINS
+    )
+    cumsum = np.concatenate(
+        (np.zeros((1, ENTROPY_BINS)), np.cumsum(histograms, axis=0, dtype=np.float64))
+    )
+    windows = cumsum[window:] - cumsum[:-window]
+    p = windows / windows.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return -np.where(p > 0, p * np.log2(p), 0.0).sum(axis=1)
+
+
+def _attention_energy(pixels):
+    """Returns energy map of edges, saturation and skin tones (of YCbCr)."""
+    r, g, b = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    luminance = _luminance(pixels)
+    edges = np.zeros_like(luminance)
+    edges[:, 1:] += np.abs(np.diff(luminance, axis=1))
+    edges[1:, :] += np.abs(np.diff(luminance, axis=0))
+    saturation = pixels.max(axis=2) - pixels.min(axis=2)
+    cb = 0.5 - 0.169 * r - 0.331 * g + 0.5 * b
+    cr = 0.5 + 0.5 * r - 0.419 * g - 0.081 * b
+    skin = (cr >= 0.53) & (cr <= 0.68) & (cb >= 0.30) & (cb <= 0.50)
+    return edges + 0.25 * saturation + 0.5 * skin
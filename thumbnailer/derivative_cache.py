@@ -0,0 +1,136 @@
+"""
+Caches rendered images (derivatives) in S3 bucket.
+
+Keys are derived from the source ETag so that the entries of modified sources are not used anymore.
+"""
+
+from os import getenv
+from hashlib import sha256
+import logging
+from config import put_annotation
+import metrics
+from vfile import S3File, ForbiddenException
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# s3://bucket/prefix/ of the cache, derivatives are not cached if not set
+DERIVATIVE_CACHE_URI = getenv("DERIVATIVE_CACHE_URI", "")
+# public (e.g. CloudFront) URL of the cache bucket, presigned S3 URLs are used if not set
+DERIVATIVE_CACHE_URL = getenv("DERIVATIVE_CACHE_URL", "")
+# validity of presigned URLs in seconds
+PRESIGNED_URL_EXPIRES_IN = int(getenv("PRESIGNED_URL_EXPIRES_IN", 60 * 60))
+# coalesce concurrent renders of the same derivative also across processes,
+# with lock objects under DERIVATIVE_CACHE_URI/locks/, see single_flight
+SINGLE_FLIGHT_LOCKS = getenv("SINGLE_FLIGHT_LOCKS", "1") != "0"
+
+
+def derivative_key(source_uri, source_etag, operation, params, settings):
+    """Returns cache key of a derivative.
+
+    The key is a hash of the source URI and ETag,
+    operation with its parameters (e.g. dimensions) and encoder settings.
+    """
+    h = sha256()
+    for part in (source_uri, source_etag, operation, params, sorted(settings.items())):
+        h.update(repr(part).encode("utf-8"))
+        h.update(b"\0")
+    return "{}/{}".format(operation, h.hexdigest())
+
+
+class DerivativeCache:
+    def __init__(self, uri_prefix, url_prefix=None, locks=False):
+        if not uri_prefix.endswith("/"):
+            uri_prefix = uri_prefix + "/"
+        self._uri_prefix = uri_prefix
+        self._url_prefix = url_prefix
+        self._single_flight = SingleFlight(uri_prefix + "locks/" if locks else None)
+
+    @property
+    def uri_prefix(self):
+        return self._uri_prefix
+
+    def uri(self, key):
+        return "{}{}".format(self._uri_prefix, key)
+
+    def url(self, key):
+        """Returns URL to GET the cached derivative without credentials.
+
+        The URL is either public (if url_prefix is set) or presigned, valid for PRESIGNED_URL_EXPIRES_IN.
+        """
+        if self._url_prefix:
+            # the URL points to the root of the bucket
+            path = S3File(self.uri(key)).key
+            return "{}/{}".format(self._url_prefix.rstrip("/"), path)
+        return S3File(self.uri(key)).presigned_url(PRESIGNED_URL_EXPIRES_IN)
+
+    def get(self, key):
+        """Returns cached data or None if not found.
+
+        Derivatives are not cached in memory (see vfile.source_cache), they would evict the sources.
+        """
+        try:
+            return S3File(self.uri(key)).read_if_exists()
+        except ForbiddenException as e:
+            logger.warning("Derivative cache not readable: {}".format(e))
+            return None
+
+    def put(self, key, data, content_type=None):
+        """Stores data in the cache, failures are logged and ignored.
+
+        Returns True if stored.
+        """
+        try:
+            return S3File(self.uri(key)).write(data, content_type=content_type)
+        except Exception as e:
+            logger.warning("Derivative cache not writable: {}".format(e))
+            return False
+
+    def render(self, source, operation, params, settings, render, content_type=None):
+        """Returns derivative of the source (VFile), rendered or from the cache.
+
+        render is called with the source opened for reading (see VFile.open)
+        only if the derivative is not cached and is not being rendered by another caller
+        (see SingleFlight).
+
+        Derivatives of sources without ETag (see VFile.etag) are not cached.
+
+        Returns (key, data) tuple, key is None if the derivative could not be cached.
+        """
+        etag = source.etag()
+        if etag is None:
+            logger.info("Not caching derivative of {} without ETag".format(source.uri))
+            metrics.set_property("DerivativeCache", "bypass")
+            return None, render(source.open())
+        key = derivative_key(source.uri, etag, operation, params, settings)
+        data = self.get(key)
+        if data is not None:
+            logger.info("Derivative cache hit: {}".format(self.uri(key)))
+            put_annotation("derivative_cache", "hit")
+            metrics.set_property("DerivativeCache", "hit")
+            return key, data
+        logger.info("Derivative cache miss: {}".format(self.uri(key)))
+        put_annotation("derivative_cache", "miss")
+        metrics.set_property("DerivativeCache", "miss")
+
+        def lookup():
+            data = self.get(key)
+            return None if data is None else (key, data)
+
+        def render_and_put():
+            data = render(source.open())
+            if not self.put(key, data, content_type=content_type):
+                return None, data
+            return key, data
+
+        return self._single_flight.run(key, lookup, render_and_put)
+
+
+def derivative_cache():
+    """Returns DerivativeCache configured with DERIVATIVE_CACHE_URI or None if not configured."""
+    if not DERIVATIVE_CACHE_URI:
+        return None
+    return DerivativeCache(
+        DERIVATIVE_CACHE_URI, DERIVATIVE_CACHE_URL, locks=SINGLE_FLIGHT_LOCKS
+    )
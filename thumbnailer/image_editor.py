@@ -1,10 +1,12 @@
 from os import getenv
 from io import BytesIO
+from contextlib import contextmanager
 from PIL import Image
 from PIL.ImageOps import fit as image_fit
 import logging
-import functools
 from config import put_annotation
+import metrics
+from admission import RENDER_BUDGET, estimate_memory
 from aws_xray_sdk.core import xray_recorder
 
 logger = logging.getLogger(__name__)
@@ -17,163 +19,1022 @@ LONG_EDGE_MAX = int(getenv("LONG_EDGE_MAX", 2000))
 # RESAMPLE_FILTER=Image.LANCZOS
 RESAMPLE_FILTER = Image.BICUBIC
 
+JPEG_QUALITY = int(getenv("JPEG_QUALITY", 75))
+WEBP_QUALITY = int(getenv("WEBP_QUALITY", 75))
 # see https://pillow.readthedocs.io/en/latest/handbook/image-file-formats.html#jpeg
-JPEG_OPTS = dict(quality=75, optimize=True)
+JPEG_OPTS = dict(quality=JPEG_QUALITY, optimize=True)
+# see https://pillow.readthedocs.io/en/latest/handbook/image-file-formats.html#webp
+WEBP_OPTS = dict(quality=WEBP_QUALITY, method=4)
+# see https://pillow.readthedocs.io/en/latest/handbook/image-file-formats.html#png
+PNG_OPTS = dict(optimize=True)
+# see https://pillow.readthedocs.io/en/latest/handbook/image-file-formats.html#gif
+GIF_OPTS = dict(optimize=True)
+
+# output formats by name, with Pillow format, content type and encoder options
+# (added to the encoder options of the preset, see PRESETS)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", "image/jpeg", {}),
+    "pjpeg": ("JPEG", "image/jpeg", dict(progressive=True)),
+    "webp": ("WEBP", "image/webp", {}),
+    "png": ("PNG", "image/png", {}),
+    # animated if the source is (see ANIMATED_OUTPUT_FORMATS)
+    "gif": ("GIF", "image/gif", {}),
+    "awebp": ("WEBP", "image/webp", {}),
+}
+# formats rendering all the frames of animated (GIF, WebP, PNG) and multi-page (TIFF) images,
+# the other ones render only the first (poster) frame, decoding none of the others
+ANIMATED_OUTPUT_FORMATS = ("gif", "awebp")
+
+# image editor presets trading CPU time for quality and size, see ImageEditor,
+# with resampling filter, reducing_gap (see Image.resize, Pillow defaults if None)
+# and encoder options by Pillow format
+PRESETS = {
+    # reduced (box filter) to about the size first, then resampled with bilinear filter,
+    # not optimizing the encoding
+    "fast": dict(
+        resample=Image.BILINEAR,
+        reducing_gap=1.0,
+        encoder_options=dict(
+            JPEG=dict(quality=JPEG_QUALITY),
+            WEBP=dict(quality=WEBP_QUALITY, method=0),
+            PNG=dict(compress_level=1),
+            GIF={},
+        ),
+    ),
+    "balanced": dict(
+        resample=RESAMPLE_FILTER,
+        reducing_gap=None,
+        encoder_options=dict(
+            JPEG=JPEG_OPTS, WEBP=WEBP_OPTS, PNG=PNG_OPTS, GIF=GIF_OPTS
+        ),
+    ),
+    # reducing_gap of 3 is indistinguishable from fair resampling
+    "best": dict(
+        resample=Image.LANCZOS,
+        reducing_gap=3.0,
+        encoder_options=dict(
+            JPEG=dict(JPEG_OPTS, progressive=True),
+            WEBP=dict(WEBP_OPTS, method=6),
+            PNG=PNG_OPTS,
+            GIF=GIF_OPTS,
+        ),
+    ),
+}
+# preset of the deployment, requests can choose another one (see ImageEditor.preset)
+IMAGE_PRESET = getenv("IMAGE_PRESET", "balanced")
+OUTPUT_FORMAT_ALIASES = {"jpg": "jpeg", "animated-webp": "awebp"}
+DEFAULT_OUTPUT_FORMAT = "jpeg"
+# formats chosen by Accept header, in order of preference,
+# mirrored by CloudFrontHeadersFunction (template.yaml) normalizing Accept in the CloudFront cache key
+ACCEPT_OUTPUT_FORMATS = [
+    ("image/webp", "webp"),
+    ("image/jpeg", "jpeg"),
+    ("image/jpg", "jpeg"),
+    ("image/png", "png"),
+]
+
+# decode JPEG images scaled down by 1/2, 1/4 or 1/8 (DCT domain) if still bigger than requested
+# see https://pillow.readthedocs.io/en/latest/reference/Image.html#PIL.Image.Image.draft
+JPEG_DRAFT = getenv("JPEG_DRAFT", "1") != "0"
+
+
+# input budget, checked before decoding the image,
+# images bigger than INPUT_PIXELS_MAX are decoded scaled down (JPEG only) if that fits the budget
+INPUT_SIZE_MAX = int(getenv("INPUT_SIZE_MAX", 50 * 1024 * 1024))
+INPUT_PIXELS_MAX = int(getenv("INPUT_PIXELS_MAX", 40 * 1000 * 1000))
+# replaced by the input budget, Pillow would reject JPEG images which could be decoded scaled down
+Image.MAX_IMAGE_PIXELS = None
+# budget of animated images (see ANIMATED_OUTPUT_FORMATS), frames and pixels of all the frames
+ANIMATION_FRAMES_MAX = int(getenv("ANIMATION_FRAMES_MAX", 100))
+ANIMATION_PIXELS_MAX = int(getenv("ANIMATION_PIXELS_MAX", 200 * 1000 * 1000))
+# milliseconds, of frames without duration (e.g. TIFF pages)
+ANIMATION_FRAME_DURATION = int(getenv("ANIMATION_FRAME_DURATION", 500))
+
+# strategies choosing the crop window of fitted images, see crop.crop_centering
+CROP_STRATEGIES = ("centre", "entropy", "attention")
+CROP_STRATEGY_ALIASES = {"center": "centre"}
+DEFAULT_CROP_STRATEGY = "centre"
+
+EXIF_ORIENTATION_TAG = 0x0112
+# orientations for which width and height are swapped
+EXIF_ORIENTATIONS_TRANSPOSED = (5, 6, 7, 8)
+# single transpose applying EXIF orientation, see CIPA DC-008-2012
+EXIF_ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+# metadata of the source copied to the rendered images:
+# strip - none, icc - ICC color profile, preserve - ICC profile, EXIF (with orientation reset) and XMP
+METADATA_POLICIES = ("strip", "icc", "preserve")
+METADATA_POLICY = getenv("METADATA_POLICY", "strip")
+if METADATA_POLICY not in METADATA_POLICIES:
+    raise ValueError(
+        "METADATA_POLICY {} not in: {}".format(
+            METADATA_POLICY, ", ".join(METADATA_POLICIES)
+        )
+    )
 
-# TODO: change to a class
 # TODO: implement tests
 
 
+class Orientation:
+    """EXIF orientation of an image, applied with a single transpose.
+
+    Images are resized in the stored orientation and transposed when already small,
+    so that the cost does not depend on the size of the source.
+    """
+
+    def __init__(self, value=1):
+        self._value = value if value in EXIF_ORIENTATION_TRANSPOSE else 1
+
+    @staticmethod
+    def of(im):
+        """Returns orientation of the image, reading only the orientation tag of the first IFD."""
+        try:
+            return Orientation(int(im.getexif().get(EXIF_ORIENTATION_TAG, 1)))
+        except Exception:
+            return Orientation()
+
+    @property
+    def value(self):
+        return self._value
+
+    @property
+    def transposed(self):
+        """True if width and height are swapped."""
+        return self._value in EXIF_ORIENTATIONS_TRANSPOSED
+
+    def stored_size(self, size):
+        """Returns size (width, height) as displayed in the stored orientation."""
+        return (size[1], size[0]) if self.transposed else tuple(size)
+
+    @metrics.timed("Orient")
+    def apply(self, im):
+        """Returns the image transposed to the displayed orientation."""
+        if self._value == 1:
+            return im
+        return im.transpose(EXIF_ORIENTATION_TRANSPOSE[self._value])
+
+
+class ImageTooLargeException(Exception):
+    def __init__(self, what, value, limit):
+        message = "Image {what} {value} exceeds {limit}".format(
+            what=what, value=value, limit=limit
+        )
+        self._message = message
+        # all the arguments, so that it can be pickled (e.g. raised in multiprocessing worker)
+        super(ImageTooLargeException, self).__init__(what, value, limit)
+
+    @property
+    def message(self):
+        return self._message
+
+    def __str__(self):
+        return self._message
+
+
+def output_format_name(name):
+    """Returns output format name, resolving aliases.
+
+    Raises ValueError if the format is not supported.
+    """
+    name = OUTPUT_FORMAT_ALIASES.get(name.lower(), name.lower())
+    if name not in OUTPUT_FORMATS:
+        raise ValueError(
+            "Format {} not in: {}".format(name, ", ".join(OUTPUT_FORMATS.keys()))
+        )
+    return name
+
+
+def negotiate_output_format(accept):
+    """Returns name of the output format the most preferred by Accept header (value).
+
+    Media ranges (e.g. image/*) select DEFAULT_OUTPUT_FORMAT,
+    see https://tools.ietf.org/html/rfc7231#section-5.3.2
+    """
+    qualities = {}
+    for media_range in (accept or "").split(","):
+        params = media_range.strip().split(";")
+        media_type = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    pass
+        qualities[media_type] = quality
+    best, best_quality = DEFAULT_OUTPUT_FORMAT, 0.0
+    for media_type, name in ACCEPT_OUTPUT_FORMATS:
+        quality = qualities.get(media_type, 0.0)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    # media types listed explicitly take precedence over media ranges of the same quality
+    default_quality = max(qualities.get("image/*", 0.0), qualities.get("*/*", 0.0))
+    if best_quality < default_quality:
+        return DEFAULT_OUTPUT_FORMAT
+    return best
+
+
+def crop_strategy_name(name):
+    """Returns crop strategy name, resolving aliases.
+
+    Raises ValueError if the strategy is not supported.
+    """
+    name = CROP_STRATEGY_ALIASES.get(name.lower(), name.lower())
+    if name not in CROP_STRATEGIES:
+        raise ValueError("Crop {} not in: {}".format(name, ", ".join(CROP_STRATEGIES)))
+    return name
+
+
+def content_type(output_format):
+    return OUTPUT_FORMATS[output_format][1]
+
+
+def file_extension(output_format):
+    pil_format = OUTPUT_FORMATS[output_format][0]
+    return "jpg" if pil_format == "JPEG" else pil_format.lower()
+
+
 @xray_recorder.capture("get_size_image_data")
 def get_size_image_data(data):
-    # TODO: possible to read from header, no need to read the image itself
+    # see image_info.probe_image_info to read it without reading the whole file
     b = BytesIO(data)
     im = Image.open(b)
     return im.size
 
 
-@xray_recorder.capture("resize_image_data")
-def resize_image_data(data, long_edge_pixels, dont_enlarge=True):
-    """Resizes image data.
-
-    Raises TypeError if data is not bytes.
-    Raises TypeError if long_edge_pixels is not int.
-    Raises ValueError if long_edge_pixels is < LONG_EDGE_MIN or > LONG_EDGE_MAX.
-    Raises IOError if the data is not a valid JPEG image.
+class ImageEditor:
+    """Resizes and fits images with resampling and encoder options of a preset (see PRESETS).
 
-    Returns data (bytes) with resized JPEG image.
+    All the operations share the pipeline:
+    header checked against the input budget, scaled down decoding (draft), resampling,
+    orientation (see Orientation) and encoding.
     """
 
-    if not isinstance(long_edge_pixels, int):
-        raise TypeError("long_edge_pixels is not int")
-    if long_edge_pixels < LONG_EDGE_MIN or long_edge_pixels > LONG_EDGE_MAX:
-        raise ValueError(
-            "MIN_LONG_EDGE = {0}, MAX_LONG_EDGE = {1}".format(
-                LONG_EDGE_MIN, LONG_EDGE_MAX
-            )
+    _presets = {}
+
+    def __init__(
+        self,
+        resample=RESAMPLE_FILTER,
+        reducing_gap=None,
+        encoder_options=None,
+        draft=JPEG_DRAFT,
+        name=None,
+        budget=RENDER_BUDGET,
+    ):
+        self._resample = resample
+        self._reducing_gap = reducing_gap
+        self._encoder_options = (
+            encoder_options or PRESETS["balanced"]["encoder_options"]
         )
+        self._draft = draft
+        self._name = name
+        self._budget = budget
 
-    b = BytesIO(data)
-    im = Image.open(b)
-    im_res = im.size
-    if dont_enlarge and long_edge_pixels > max(im.width, im.height):
-        logger.info(
-            "Image resolution {im_res[0]}x{im_res[1]} smaller than requested {0}px".format(
-                long_edge_pixels, im_res=im_res
+    @staticmethod
+    def preset(name=None):
+        """Returns (shared) editor of the preset (see PRESETS), of IMAGE_PRESET if name is not set.
+
+        Raises ValueError if the preset does not exist.
+        """
+        name = (name or IMAGE_PRESET).lower()
+        if name not in PRESETS:
+            raise ValueError(
+                "Preset {} not in: {}".format(name, ", ".join(PRESETS.keys()))
+            )
+        editor = ImageEditor._presets.get(name)
+        if editor is None:
+            editor = ImageEditor._presets[name] = ImageEditor(
+                name=name, **PRESETS[name]
             )
+        return editor
+
+    @property
+    def name(self):
+        return self._name
+
+    def encoder_options(self, output_format):
+        pil_format, _, options = OUTPUT_FORMATS[output_format]
+        return dict(self._encoder_options[pil_format], **options)
+
+    def encoder_settings(self, output_format):
+        """Returns settings affecting the rendered images, used to derive cache keys."""
+        settings = dict(
+            format=OUTPUT_FORMATS[output_format][0],
+            resample=int(self._resample),
+            draft=self._draft,
+            **self.encoder_options(output_format)
         )
-        return data
-    th_res = (long_edge_pixels, long_edge_pixels)
-    im = _process_exif_data(im)
-    im.thumbnail(th_res, resample=RESAMPLE_FILTER)
-    if im.mode != "RGB":
-        im = im.convert("RGB")
-    th_res = im.size
-    output = BytesIO()
-    im.save(output, "JPEG", **JPEG_OPTS)
-    im.close()
-    outdata = output.getvalue()
-    logger.info(
-        "Resized ({im_res[0]}x{im_res[1]}) {im_size} bytes to ({th_res[0]}x{th_res[1]}) {th_size} bytes".format(
-            im_res=im_res, im_size=len(data), th_res=th_res, th_size=len(outdata)
+        if output_format in ANIMATED_OUTPUT_FORMATS:
+            settings["animated"] = True
+        # not set if default, so that keys of the derivatives cached before stay valid
+        if self._reducing_gap is not None:
+            settings["reducing_gap"] = self._reducing_gap
+        if METADATA_POLICY != "strip":
+            settings["metadata"] = METADATA_POLICY
+        return settings
+
+    @xray_recorder.capture("ImageEditor.resize")
+    def resize(
+        self,
+        data,
+        long_edge_pixels,
+        dont_enlarge=True,
+        output_format=DEFAULT_OUTPUT_FORMAT,
+        draft=None,
+    ):
+        """Resizes image data.
+
+        Decodes JPEG images scaled down (if still bigger than requested) unless draft is False.
+        Encodes the image in output_format (see OUTPUT_FORMATS),
+        if dont_enlarge and the image is smaller than requested it is only re-encoded if in other format.
+        All the frames of animated images are resized if output_format is animated (see ANIMATED_OUTPUT_FORMATS).
+
+        Data is bytes or binary file (closed once decoded).
+
+        Raises TypeError if data is not bytes or binary file.
+        Raises TypeError if long_edge_pixels is not int.
+        Raises ValueError if long_edge_pixels is < LONG_EDGE_MIN or > LONG_EDGE_MAX.
+        Raises ImageTooLargeException if the image exceeds INPUT_SIZE_MAX, INPUT_PIXELS_MAX
+        or if animated ANIMATION_FRAMES_MAX or ANIMATION_PIXELS_MAX.
+        Raises IOError if the data is not a valid image.
+
+        Returns data (bytes) with resized image.
+        """
+        _check_pixels("long_edge_pixels", long_edge_pixels)
+
+        b, data_size, im = _open_image(data)
+        try:
+            im_res = im.size
+            orientation = Orientation.of(im)
+            metadata = _read_metadata(im)
+            if dont_enlarge and long_edge_pixels > max(im.width, im.height):
+                logger.info(
+                    "Image resolution {im_res[0]}x{im_res[1]} smaller than requested {0}px".format(
+                        long_edge_pixels, im_res=im_res
+                    )
+                )
+                if im.format == OUTPUT_FORMATS[output_format][0]:
+                    return _read_source(data, b)
+                long_edge_pixels = max(im.width, im.height)
+            th_res = (long_edge_pixels, long_edge_pixels)
+            # long edge is the same regardless of the orientation
+            scale = long_edge_pixels / max(im.width, im.height)
+            if _is_animated(im, output_format):
+                th_res = (
+                    max(1, round(im.width * scale)),
+                    max(1, round(im.height * scale)),
+                )
+                outdata = self._animate(
+                    im,
+                    b,
+                    output_format,
+                    metadata,
+                    orientation,
+                    th_res,
+                    lambda frame, index: self._resize(frame, th_res),
+                )
+                _log_result("Resized", im_res, data_size, th_res, outdata)
+                return outdata
+            with self._decoded(
+                im, b, (round(im.width * scale), round(im.height * scale)), draft
+            ):
+                with metrics.timed("Resample"):
+                    im.thumbnail(
+                        th_res, resample=self._resample, **self._reducing_gap_option()
+                    )
+                im = orientation.apply(im)
+                outdata = self._encode(im, output_format, metadata)
+            _log_result("Resized", im_res, data_size, im.size, outdata)
+            im.close()
+            return outdata
+        finally:
+            b.close()
+
+    @xray_recorder.capture("ImageEditor.fit")
+    def fit(
+        self,
+        data,
+        width,
+        height,
+        output_format=DEFAULT_OUTPUT_FORMAT,
+        crop=DEFAULT_CROP_STRATEGY,
+        draft=None,
+    ):
+        """Fits image data that is
+        returns a sized and cropped version of the image, cropped to the requested aspect ratio and size.
+
+        Decodes JPEG images scaled down (if still bigger than requested) unless draft is False.
+        Encodes the image in output_format (see OUTPUT_FORMATS).
+        The crop window is chosen by crop strategy (see CROP_STRATEGIES), centred by default.
+        All the frames of animated images are fitted (in the crop window of the first one)
+        if output_format is animated (see ANIMATED_OUTPUT_FORMATS).
+
+        Data is bytes or binary file (closed once decoded).
+
+        Raises TypeError if data is not bytes or binary file.
+        Raises TypeError if width or height is not int.
+        Raises ValueError if width or height is < LONG_EDGE_MIN or > LONG_EDGE_MAX.
+        Raises ValueError if crop is not supported.
+        Raises ImageTooLargeException if the image exceeds INPUT_SIZE_MAX, INPUT_PIXELS_MAX
+        or if animated ANIMATION_FRAMES_MAX or ANIMATION_PIXELS_MAX.
+        Raises IOError if the data is not a valid image.
+
+        Returns data (bytes) with resized and cropped image.
+        """
+        _check_pixels("width", width)
+        _check_pixels("height", height)
+        crop = crop_strategy_name(crop)
+
+        b, data_size, im = _open_image(data)
+        try:
+            im_res = im.size
+            orientation = Orientation.of(im)
+            metadata = _read_metadata(im)
+            # fitted in the stored orientation, transposed once small
+            th_res = orientation.stored_size((width, height))
+            if _is_animated(im, output_format):
+                centering = []
+
+                def fit_frame(frame, index):
+                    if index == 0:
+                        centering.append(_crop_centering(frame, th_res, crop))
+                    return self._fit(frame, th_res, centering[0])
+
+                outdata = self._animate(
+                    im, b, output_format, metadata, orientation, th_res, fit_frame
+                )
+                _log_result("Fit", im_res, data_size, (width, height), outdata)
+                return outdata
+            with self._decoded(im, b, th_res, draft):
+                centering = _crop_centering(im, th_res, crop)
+                im = self._fit(im, th_res, centering)
+                im = orientation.apply(im)
+                outdata = self._encode(im, output_format, metadata)
+            _log_result("Fit", im_res, data_size, im.size, outdata)
+            im.close()
+            return outdata
+        finally:
+            b.close()
+
+    @xray_recorder.capture("ImageEditor.batch")
+    def batch(
+        self,
+        data,
+        long_edges=(),
+        fits=(),
+        output_format=DEFAULT_OUTPUT_FORMAT,
+        draft=None,
+    ):
+        """Resizes (see resize) and fits (see fit) image data to many sizes at once.
+
+        The image is decoded only once, scaled down (unless draft is False) to the size needed by the biggest one.
+        Each resized image is derived from the next bigger one,
+        each fitted image from the smallest resized image that is still big enough.
+        Animated images in animated output_format (see ANIMATED_OUTPUT_FORMATS)
+        are decoded for each of the sizes.
+
+        Raises TypeError if any of the sizes is not int.
+        Raises ValueError if any of the sizes is < LONG_EDGE_MIN or > LONG_EDGE_MAX.
+        Raises ImageTooLargeException if the image exceeds INPUT_SIZE_MAX or INPUT_PIXELS_MAX.
+        Raises IOError if the data is not a valid image.
+
+        Returns tuple of lists with data (bytes) of resized and fitted images (in output_format),
+        in the order of long_edges and fits.
+        """
+        for long_edge_pixels in long_edges:
+            _check_pixels("long_edge_pixels", long_edge_pixels)
+        for width, height in fits:
+            _check_pixels("width", width)
+            _check_pixels("height", height)
+        if not long_edges and not fits:
+            return [], []
+
+        b, data_size, im = _open_image(data)
+        try:
+            if _is_animated(im, output_format):
+                data = _read_source(data, b)
+                return (
+                    [
+                        self.resize(data, long_edge_pixels, output_format=output_format)
+                        for long_edge_pixels in long_edges
+                    ],
+                    [
+                        self.fit(data, width, height, output_format=output_format)
+                        for width, height in fits
+                    ],
+                )
+            im_res = im.size
+            im_format = im.format
+            orientation = Orientation.of(im)
+            metadata = _read_metadata(im)
+            # the smallest size covering all the requested sizes (in the stored orientation)
+            dr_res = (0, 0)
+            for long_edge_pixels in long_edges:
+                scale = min(long_edge_pixels / max(im_res), 1.0)
+                dr_res = (
+                    max(dr_res[0], round(im_res[0] * scale)),
+                    max(dr_res[1], round(im_res[1] * scale)),
+                )
+            for width, height in map(orientation.stored_size, fits):
+                dr_res = (max(dr_res[0], width), max(dr_res[1], height))
+            # returned as it is for the sizes bigger than the image, read before the source is closed
+            source = None
+            if im_format == OUTPUT_FORMATS[output_format][0] and any(
+                long_edge_pixels > max(im_res) for long_edge_pixels in long_edges
+            ):
+                source = _read_source(data, b)
+            with self._decoded(im, b, dr_res, draft):
+                im = _convert_image(im, output_format)
+
+                def encode(th):
+                    return self._encode(orientation.apply(th), output_format, metadata)
+
+                # uncropped images (in the stored orientation), from the biggest to the smallest
+                levels = [im]
+                resized = {}
+                for long_edge_pixels in sorted(set(long_edges), reverse=True):
+                    if long_edge_pixels > max(im_res):
+                        if source is not None:
+                            resized[long_edge_pixels] = source
+                        else:
+                            resized[long_edge_pixels] = encode(im)
+                        continue
+                    scale = long_edge_pixels / max(im.size)
+                    th_res = (
+                        max(1, round(im.width * scale)),
+                        max(1, round(im.height * scale)),
+                    )
+                    with metrics.timed("Resample"):
+                        level = levels[-1].resize(
+                            th_res,
+                            resample=self._resample,
+                            **self._reducing_gap_option()
+                        )
+                    levels.append(level)
+                    resized[long_edge_pixels] = encode(level)
+                fitted = {}
+                for size in set(map(tuple, fits)):
+                    width, height = orientation.stored_size(size)
+                    level = next(
+                        (
+                            lv
+                            for lv in reversed(levels)
+                            if lv.width >= width and lv.height >= height
+                        ),
+                        im,
+                    )
+                    th = self._fit(level, (width, height))
+                    fitted[size] = encode(th)
+                    th.close()
+                for level in levels:
+                    level.close()
+
+            logger.info(
+                "Batch ({im_res[0]}x{im_res[1]}) {im_size} bytes to {th_count} images {th_size} bytes".format(
+                    im_res=im_res,
+                    im_size=data_size,
+                    th_count=len(resized) + len(fitted),
+                    th_size=sum(map(len, resized.values()))
+                    + sum(map(len, fitted.values())),
+                )
+            )
+            put_annotation("original_width", "{}".format(im_res[0]))
+            put_annotation("original_height", "{}".format(im_res[1]))
+            put_annotation("original_size", "{}".format(data_size))
+            put_annotation("batch_count", "{}".format(len(resized) + len(fitted)))
+            return (
+                [resized[long_edge_pixels] for long_edge_pixels in long_edges],
+                [fitted[tuple(size)] for size in fits],
+            )
+        finally:
+            b.close()
+
+    @xray_recorder.capture("ImageEditor.placeholder")
+    def placeholder(self, data):
+        """Returns placeholder (see placeholder.Placeholder) of image data,
+        computed from the image decoded scaled down, 1/8 of the most of JPEG images.
+
+        Data is bytes or binary file (closed once decoded).
+
+        Raises ImageTooLargeException if the image exceeds INPUT_SIZE_MAX or INPUT_PIXELS_MAX.
+        Raises IOError if the data is not a valid image.
+        """
+        # imports numpy, only when needed
+        from placeholder import placeholder, PLACEHOLDER_PROXY_SIZE
+
+        b, data_size, im = _open_image(data)
+        try:
+            orientation = Orientation.of(im)
+            # swapped back if transposed
+            size = orientation.stored_size(im.size)
+            scale = min(PLACEHOLDER_PROXY_SIZE / max(im.size), 1.0)
+            proxy_res = (
+                max(1, round(im.width * scale)),
+                max(1, round(im.height * scale)),
+            )
+            with self._decoded(im, b, proxy_res, draft=True):
+                im = _convert_image(im, "JPEG")
+                with metrics.timed("Resample"):
+                    im = im.resize(proxy_res, resample=Image.BOX)
+                im = orientation.apply(im)
+                with metrics.timed("Placeholder"):
+                    return placeholder(im, size)
+        finally:
+            b.close()
+
+    @contextmanager
+    def _decoded(self, im, b, size, draft=None):
+        """Decodes the image (see _load_image), scaled down to at least size (see _draft_image)
+        unless draft (editor's if None) is False and the image is within the input budget.
+
+        Memory of the render is reserved (see admission) until the context exits.
+        The source binary file b is closed when decoded, or when the context exits on failure.
+
+        Raises ImageTooLargeException if the image exceeds INPUT_PIXELS_MAX.
+        Raises RenderRejectedException if the memory is not available.
+        """
+        try:
+            im_res = im.size
+            if draft is None:
+                draft = self._draft
+            if draft or _exceeds_input_pixels(im):
+                _draft_image(im, size)
+            _check_input_pixels(im, im_res)
+            estimate = estimate_memory(im)
+            self._budget.reserve(estimate)
+            try:
+                _load_image(im, b)
+                yield
+            finally:
+                self._budget.release(estimate)
+        finally:
+            b.close()
+
+    def _animate(self, im, b, output_format, metadata, orientation, size, render_frame):
+        """Renders all the frames of animated image, not decoded yet,
+        with render_frame(frame, index) returning the frame of size (in the stored orientation).
+
+        The frames are decoded one at a time, only the rendered ones are kept (by the encoder).
+        The source binary file b is closed once the frames are decoded, or on failure.
+
+        Raises ImageTooLargeException if the image exceeds ANIMATION_FRAMES_MAX or ANIMATION_PIXELS_MAX.
+        Raises RenderRejectedException if the memory is not available.
+
+        Returns data (bytes) with the animation encoded in output_format.
+        """
+        try:
+            _check_input_pixels(im, im.size)
+            n_frames = _check_animation(im)
+            # a decoded frame and the rendered ones
+            estimate = estimate_memory(im) + n_frames * size[0] * size[1] * 4
+            self._budget.reserve(estimate)
+        except Exception:
+            b.close()
+            raise
+        try:
+            frames = []
+            durations = []
+            for index in range(n_frames):
+                im.seek(index)
+                with metrics.timed("Decode"):
+                    im.load()
+                durations.append(im.info.get("duration") or ANIMATION_FRAME_DURATION)
+                frame = _convert_image(im, output_format)
+                with metrics.timed("Resample"):
+                    frame = render_frame(frame, index)
+                frames.append(orientation.apply(frame))
+            loop = im.info.get("loop", 0)
+            b.close()
+            metrics.put_metric("Frames", n_frames, metrics.COUNT)
+            return _encode_frames(
+                frames,
+                OUTPUT_FORMATS[output_format][0],
+                dict(
+                    self.encoder_options(output_format), duration=durations, loop=loop
+                ),
+                metadata,
+            )
+        finally:
+            b.close()
+            self._budget.release(estimate)
+
+    def _resize(self, im, size):
+        return im.resize(size, resample=self._resample, **self._reducing_gap_option())
+
+    def _reducing_gap_option(self):
+        if self._reducing_gap is None:
+            return {}
+        return dict(reducing_gap=self._reducing_gap)
+
+    def _fit(self, im, size, centering=(0.5, 0.5)):
+        with metrics.timed("Resample"):
+            if self._reducing_gap is not None:
+                # ImageOps.fit has no reducing_gap
+                factor = int(
+                    min(im.width / size[0], im.height / size[1]) / self._reducing_gap
+                )
+                if factor > 1:
+                    im = im.reduce(factor)
+            return image_fit(im, size, method=self._resample, centering=centering)
+
+    def _encode(self, im, output_format, metadata=None):
+        return _encode_image(
+            im,
+            OUTPUT_FORMATS[output_format][0],
+            self.encoder_options(output_format),
+            metadata,
         )
+
+
+def encoder_settings(output_format):
+    """Returns settings of the default editor (see ImageEditor.encoder_settings)."""
+    return ImageEditor.preset().encoder_settings(output_format)
+
+
+def resize_image_data(
+    data,
+    long_edge_pixels,
+    dont_enlarge=True,
+    draft=JPEG_DRAFT,
+    output_format=DEFAULT_OUTPUT_FORMAT,
+):
+    """Resizes image data with the default editor, see ImageEditor.resize."""
+    return ImageEditor.preset().resize(
+        data,
+        long_edge_pixels,
+        dont_enlarge=dont_enlarge,
+        output_format=output_format,
+        draft=draft,
     )
-    put_annotation("original_width", "{}".format(im_res[0]))
-    put_annotation("original_height", "{}".format(im_res[1]))
-    put_annotation("original_size", "{}".format(len(data)))
-    put_annotation("resized_width", "{}".format(th_res[0]))
-    put_annotation("resized_height", "{}".format(th_res[1]))
-    put_annotation("resized_size", "{}".format(len(outdata)))
-    return outdata
 
 
-@xray_recorder.capture("fit_image_data")
-def fit_image_data(data, width, height):
-    """Fits image data that is
-    returns a sized and cropped version of the image, cropped to the requested aspect ratio and size.
+def fit_image_data(
+    data,
+    width,
+    height,
+    draft=JPEG_DRAFT,
+    output_format=DEFAULT_OUTPUT_FORMAT,
+    crop=DEFAULT_CROP_STRATEGY,
+):
+    """Fits image data with the default editor, see ImageEditor.fit."""
+    return ImageEditor.preset().fit(
+        data, width, height, output_format=output_format, crop=crop, draft=draft
+    )
+
+
+def batch_image_data(
+    data,
+    long_edges=(),
+    fits=(),
+    draft=JPEG_DRAFT,
+    output_format=DEFAULT_OUTPUT_FORMAT,
+):
+    """Resizes and fits image data with the default editor, see ImageEditor.batch."""
+    return ImageEditor.preset().batch(
+        data, long_edges, fits, output_format=output_format, draft=draft
+    )
+
+
+def placeholder_settings():
+    """Returns settings affecting the placeholders, used to derive cache keys."""
+    # imports numpy, only when needed
+    from placeholder import PLACEHOLDER_SETTINGS
+
+    return PLACEHOLDER_SETTINGS
+
+
+def placeholder_image_data(data):
+    """Returns placeholder of image data with the default editor, see ImageEditor.placeholder."""
+    return ImageEditor.preset().placeholder(data)
+
 
-    Raises TypeError if data is not bytes.
-    Raises TypeError if width or height is not int.
-    Raises ValueError if width or height is < LONG_EDGE_MIN or > LONG_EDGE_MAX.
-    Raises IOError if the data is not a valid JPEG image.
+def check_input_size(data_size):
+    """Raises ImageTooLargeException if data_size (in bytes) exceeds INPUT_SIZE_MAX.
 
-    Returns data (bytes) with resized and cropped JPEG image.
+    Check the size of the source (see VFile.size) before reading it,
+    does nothing if data_size is None (not known).
     """
+    if data_size is not None and data_size > INPUT_SIZE_MAX:
+        metrics.put_metric("InputRejected", 1, metrics.COUNT)
+        raise ImageTooLargeException("size", data_size, INPUT_SIZE_MAX)
 
-    if not isinstance(width, int):
-        raise TypeError("width is not int")
-    if not isinstance(height, int):
-        raise TypeError("height is not int")
-    if width < LONG_EDGE_MIN or width > LONG_EDGE_MAX:
-        raise ValueError(
-            "MIN_LONG_EDGE = {0}, MAX_LONG_EDGE = {1}".format(
-                LONG_EDGE_MIN, LONG_EDGE_MAX
-            )
-        )
-    if height < LONG_EDGE_MIN or height > LONG_EDGE_MAX:
+
+def _check_pixels(name, value):
+    if not isinstance(value, int):
+        raise TypeError("{} is not int".format(name))
+    if value < LONG_EDGE_MIN or value > LONG_EDGE_MAX:
         raise ValueError(
             "MIN_LONG_EDGE = {0}, MAX_LONG_EDGE = {1}".format(
                 LONG_EDGE_MIN, LONG_EDGE_MAX
             )
         )
 
-    b = BytesIO(data)
-    im = Image.open(b)
-    im_res = im.size
-    th_res = (width, height)
-    im = _process_exif_data(im)
-    im = image_fit(im, th_res, method=RESAMPLE_FILTER)
-    if im.mode != "RGB":
-        im = im.convert("RGB")
-    th_res = im.size
-    output = BytesIO()
-    im.save(output, "JPEG", **JPEG_OPTS)
-    im.close()
-    outdata = output.getvalue()
+
+def _open_image(data):
+    """Opens (without decoding) the image of data, bytes or binary file,
+    checking its size against INPUT_SIZE_MAX. The binary file is closed if it fails.
+
+    Returns (binary file, size in bytes, image).
+    """
+    b, data_size = _open_source(data)
+    try:
+        check_input_size(data_size)
+        im = Image.open(b)
+    except Exception:
+        b.close()
+        raise
+    _put_source_metrics(im.size, data_size)
+    return b, data_size, im
+
+
+def _log_result(operation, im_res, data_size, th_res, outdata):
     logger.info(
-        "Fit ({im_res[0]}x{im_res[1]}) {im_size} bytes to ({th_res[0]}x{th_res[1]}) {th_size} bytes".format(
-            im_res=im_res, im_size=len(data), th_res=th_res, th_size=len(outdata)
+        "{operation} ({im_res[0]}x{im_res[1]}) {im_size} bytes to ({th_res[0]}x{th_res[1]}) {th_size} bytes".format(
+            operation=operation,
+            im_res=im_res,
+            im_size=data_size,
+            th_res=th_res,
+            th_size=len(outdata),
         )
     )
     put_annotation("original_width", "{}".format(im_res[0]))
     put_annotation("original_height", "{}".format(im_res[1]))
-    put_annotation("original_size", "{}".format(len(data)))
+    put_annotation("original_size", "{}".format(data_size))
     put_annotation("resized_width", "{}".format(th_res[0]))
     put_annotation("resized_height", "{}".format(th_res[1]))
     put_annotation("resized_size", "{}".format(len(outdata)))
-    return outdata
 
 
-# TODO: review/remove
+def _is_animated(im, output_format):
+    """Returns True if the image has more frames (or pages) and all of them are rendered."""
+    return output_format in ANIMATED_OUTPUT_FORMATS and getattr(im, "n_frames", 1) > 1
 
 
-def _process_exif_data(im):
-    # Ref: https://stackoverflow.com/questions/4228530/pil-thumbnail-is-rotating-my-image  # NOQA
+def _check_animation(im):
+    """Returns number of frames of the image.
+
+    Raises ImageTooLargeException if it exceeds ANIMATION_FRAMES_MAX or ANIMATION_PIXELS_MAX.
     """
-        Apply Image.transpose to ensure 0th row of pixels is at the visual
-        top of the image, and 0th column is the visual left-hand side.
-        Return the original image if unable to determine the orientation.
+    n_frames = im.n_frames
+    if n_frames > ANIMATION_FRAMES_MAX:
+        raise ImageTooLargeException("frames", n_frames, ANIMATION_FRAMES_MAX)
+    pixels = n_frames * im.width * im.height
+    if pixels > ANIMATION_PIXELS_MAX:
+        raise ImageTooLargeException(
+            "pixels of all the frames", pixels, ANIMATION_PIXELS_MAX
+        )
+    return n_frames
+
+
+def _crop_centering(im, size, crop):
+    """Returns centering (see PIL.ImageOps.fit) of the crop window chosen by crop strategy."""
+    if crop == DEFAULT_CROP_STRATEGY:
+        return 0.5, 0.5
+    # imports numpy, only when needed
+    from crop import crop_centering
+
+    # the energy does not depend on the orientation
+    with metrics.timed("Crop"):
+        return crop_centering(im, size, crop)
+
 
-        As per CIPA DC-008-2012, the orientation field contains an integer,
-        1 through 8. Other values are reserved.
+def _put_source_metrics(im_res, data_size):
+    metrics.put_metric("SourceBytes", data_size, metrics.BYTES)
+    metrics.put_metric("SourceMegapixels", im_res[0] * im_res[1] / 1e6)
+
+
+def _exceeds_input_pixels(im):
+    return im.width * im.height > INPUT_PIXELS_MAX
+
+
+def _check_input_pixels(im, im_res):
+    """Raises ImageTooLargeException if the image, as it is going to be decoded (see _draft_image),
+    exceeds INPUT_PIXELS_MAX, im_res is the original size of the image.
     """
+    if _exceeds_input_pixels(im):
+        metrics.put_metric("InputRejected", 1, metrics.COUNT)
+        raise ImageTooLargeException("pixels", im.width * im.height, INPUT_PIXELS_MAX)
+    if im_res[0] * im_res[1] > INPUT_PIXELS_MAX:
+        logger.info(
+            "Image ({im_res[0]}x{im_res[1]}) over budget decoded as ({dr_res[0]}x{dr_res[1]})".format(
+                im_res=im_res, dr_res=im.size
+            )
+        )
+        metrics.put_metric("InputReduced", 1, metrics.COUNT)
 
-    exif_orientation_tag = 0x0112
-    exif_transpose_sequences = [  # Val  0th row  0th col
-        [],  #  0    (reserved)
-        [],  #  1   top      left
-        [Image.FLIP_LEFT_RIGHT],  #  2   top      right
-        [Image.ROTATE_180],  #  3   bottom   right
-        [Image.FLIP_TOP_BOTTOM],  #  4   bottom   left
-        [Image.FLIP_LEFT_RIGHT, Image.ROTATE_90],  #  5   left     top
-        [Image.ROTATE_270],  #  6   right    top
-        [Image.FLIP_TOP_BOTTOM, Image.ROTATE_90],  #  7   right    bottom
-        [Image.ROTATE_90],  #  8   left     bottom
-    ]
 
-    try:
-        seq = exif_transpose_sequences[im._getexif()[exif_orientation_tag]]
-    except Exception:
-        return im
-    else:
-        return functools.reduce(type(im).transpose, seq, im)
+def _open_source(data):
+    """Returns (binary file, size in bytes) of data, which is bytes or binary file."""
+    if isinstance(data, (bytes, bytearray)):
+        return BytesIO(data), len(data)
+    if not hasattr(data, "read"):
+        raise TypeError("data is not bytes or binary file")
+    data.seek(0, 2)
+    size = data.tell()
+    data.seek(0)
+    return data, size
+
+
+def _read_source(data, b):
+    """Returns data as bytes, b is the source binary file (see _open_source)."""
+    if isinstance(data, (bytes, bytearray)):
+        return data
+    b.seek(0)
+    return b.read()
+
+
+@metrics.timed("Decode")
+def _load_image(im, b):
+    """Decodes the image and closes the source binary file (see _open_source),
+    the compressed data is released if not referenced elsewhere.
+    """
+    im.load()
+    b.close()
+
+
+def _convert_image(im, output_format):
+    """Converts the image to RGB, or to RGBA if it has transparency and the format supports it.
+
+    output_format is the name (see OUTPUT_FORMATS) or Pillow format.
+    """
+    pil_format = OUTPUT_FORMATS.get(output_format, (output_format,))[0]
+    has_alpha = im.mode in ("RGBA", "LA", "PA") or "transparency" in im.info
+    mode = "RGBA" if has_alpha and pil_format != "JPEG" else "RGB"
+    if im.mode != mode:
+        im = im.convert(mode)
+    return im
+
+
+@metrics.timed("Encode")
+def _encode_image(im, pil_format, options, metadata=None):
+    """Returns the image encoded in Pillow format with options and metadata (see _read_metadata)."""
+    im = _convert_image(im, pil_format)
+    output = BytesIO()
+    im.save(output, pil_format, **dict(options, **(metadata or _NO_METADATA)))
+    return output.getvalue()
+
+
+# the encoders of some formats (PNG) copy the ICC profile of the image unless set
+_NO_METADATA = dict(icc_profile=None)
+
+
+@metrics.timed("Encode")
+def _encode_frames(frames, pil_format, options, metadata=None):
+    """Returns the frames encoded as animation in Pillow format with options and metadata."""
+    output = BytesIO()
+    frames[0].save(
+        output,
+        pil_format,
+        save_all=True,
+        append_images=frames[1:],
+        **dict(options, **(metadata or _NO_METADATA))
+    )
+    return output.getvalue()
+
+
+def _read_metadata(im):
+    """Returns the metadata of the source image kept according to METADATA_POLICY,
+    as encoder options (see _encode_image).
+    """
+    if METADATA_POLICY == "strip":
+        return _NO_METADATA
+    metadata = dict(icc_profile=im.info.get("icc_profile"))
+    if METADATA_POLICY == "preserve":
+        try:
+            exif = im.getexif()
+            if exif:
+                # the pixels are transposed to the displayed orientation
+                exif[EXIF_ORIENTATION_TAG] = 1
+                metadata["exif"] = exif.tobytes()
+        except Exception as e:
+            logger.warning("Failed to read EXIF: {}".format(e))
+        if im.info.get("xmp"):
+            metadata["xmp"] = im.info["xmp"]
+    return metadata
+
+
+def _draft_image(im, size):
+    """Configures JPEG decoder to decode the image with the smallest scale (1/2, 1/4 or 1/8)
+    that is still at least the size (in the stored, not EXIF transposed orientation).
+
+    Does nothing if the image is not JPEG or if it is already loaded.
+    """
+    if im.format != "JPEG":
+        return
+    im_res = im.size
+    im.draft(im.mode, size)
+    if im.size != im_res:
+        logger.info(
+            "Decoding ({im_res[0]}x{im_res[1]}) as ({dr_res[0]}x{dr_res[1]})".format(
+                im_res=im_res, dr_res=im.size
+            )
+        )
@@ -0,0 +1,81 @@
+"""
+Reads image metadata from the file header without reading the whole file.
+"""
+
+from os import getenv
+from io import BytesIO
+from pydantic import BaseModel
+from PIL import Image
+import logging
+from config import put_annotation
+from aws_xray_sdk.core import xray_recorder
+
+logger = logging.getLogger(__name__)
+
+
+# the first read, big enough for headers of most of JPEG and PNG files
+PROBE_SIZE = int(getenv("PROBE_SIZE", 16 * 1024))
+# the read is extended (by PROBE_GROWTH_FACTOR) until the header can be parsed,
+# the whole file is read if it still fails after reading PROBE_SIZE_MAX
+PROBE_SIZE_MAX = int(getenv("PROBE_SIZE_MAX", 1024 * 1024))
+PROBE_GROWTH_FACTOR = 4
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+class ImageInfo(BaseModel):
+    width: int
+    height: int
+    format: str
+    mode: str
+    orientation: int = 1
+
+
+def _open_image_info(data):
+    im = Image.open(BytesIO(data))
+    try:
+        orientation = int(im.getexif().get(EXIF_ORIENTATION_TAG, 1))
+    except Exception:
+        orientation = 1
+    return ImageInfo(
+        width=im.width,
+        height=im.height,
+        format=im.format,
+        mode=im.mode,
+        orientation=orientation,
+    )
+
+
+@xray_recorder.capture("probe_image_info")
+def probe_image_info(f):
+    """Reads image info from the header of the file (VFile).
+
+    Reads only the first PROBE_SIZE bytes and more only if the header
+    does not fit in it, e.g. JPEG with SOF segment after a large EXIF block.
+
+    Raises IOError if the file is not a valid image.
+
+    Returns ImageInfo.
+    """
+
+    requested = PROBE_SIZE
+    data = f.read_range(0, requested)
+    while True:
+        eof = len(data) < requested
+        try:
+            info = _open_image_info(data)
+            break
+        except Exception:
+            if eof:
+                raise
+        if requested >= PROBE_SIZE_MAX:
+            logger.info("Header not found in {} bytes of {}".format(len(data), f))
+            data = f.read()
+            requested = len(data) + 1
+        else:
+            requested *= PROBE_GROWTH_FACTOR
+            data += f.read_range(len(data), requested - len(data))
+
+    logger.info("Read {} bytes of {} header: {}".format(len(data), f, info))
+    put_annotation("probe_size", "{}".format(len(data)))
+    return info
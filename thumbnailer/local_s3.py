@@ -0,0 +1,172 @@
+"""
+Local directory or memory standing in for S3, to run the function handler without AWS
+(see vfile.S3_LOCAL_ROOT and S3File.set_client).
+
+Implements the subset of boto3 S3 client used by vfile.S3File:
+ETags, last modified time, ranges, conditional GET (If-None-Match)
+and conditional PUT (If-None-Match: *).
+"""
+
+import os
+import threading
+from datetime import datetime, timezone
+from hashlib import md5
+from io import BytesIO
+from botocore.exceptions import ClientError
+from vfile import InvalidURIException
+
+# S3_LOCAL_ROOT keeping the objects in memory
+MEMORY_ROOT = "memory"
+
+
+class _Exceptions:
+    ClientError = ClientError
+
+    class NoSuchKey(ClientError):
+        pass
+
+
+class _DirectoryStorage:
+    """Buckets are subdirectories of the root directory."""
+
+    def __init__(self, root):
+        self._root = os.path.realpath(root)
+
+    def _path(self, bucket, key):
+        """Returns path of the object.
+
+        Raises InvalidURIException if it is not in the bucket directory (e.g. the key contains ..).
+        """
+        bucket_path = os.path.realpath(os.path.join(self._root, bucket))
+        path = os.path.realpath(os.path.join(bucket_path, key))
+        if (
+            os.path.dirname(bucket_path) != self._root
+            or os.path.commonpath([bucket_path, path]) != bucket_path
+            or path == bucket_path
+        ):
+            raise InvalidURIException("s3://{}/{}".format(bucket, key))
+        return path
+
+    def head(self, bucket, key):
+        """Returns (ETag, size, last modified) or None if the object does not exist."""
+        path = self._path(bucket, key)
+        if not os.path.isfile(path):
+            return None
+        st = os.stat(path)
+        etag = '"{:x}-{:x}"'.format(st.st_mtime_ns, st.st_size)
+        return etag, st.st_size, datetime.fromtimestamp(st.st_mtime, timezone.utc)
+
+    def get(self, bucket, key, start=0, end=None):
+        with open(self._path(bucket, key), "rb") as f:
+            f.seek(start)
+            return f.read() if end is None else f.read(end - start + 1)
+
+    def put(self, bucket, key, data, exclusive=False):
+        """Returns False if exclusive and the object exists."""
+        path = self._path(bucket, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            f = open(path, "xb" if exclusive else "wb")
+        except FileExistsError:
+            return False
+        with f:
+            f.write(data)
+        return True
+
+    def delete(self, bucket, key):
+        path = self._path(bucket, key)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def url(self, bucket, key):
+        return "file://{}".format(self._path(bucket, key))
+
+
+class _MemoryStorage:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (bucket, key) to (ETag, data, last modified)
+        self._objects = {}
+
+    def head(self, bucket, key):
+        obj = self._objects.get((bucket, key))
+        if obj is None:
+            return None
+        etag, data, last_modified = obj
+        return etag, len(data), last_modified
+
+    def get(self, bucket, key, start=0, end=None):
+        data = self._objects[(bucket, key)][1]
+        return data[start:] if end is None else data[start : end + 1]
+
+    def put(self, bucket, key, data, exclusive=False):
+        etag = '"{}"'.format(md5(data).hexdigest())
+        with self._lock:
+            if exclusive and (bucket, key) in self._objects:
+                return False
+            self._objects[(bucket, key)] = etag, data, datetime.now(timezone.utc)
+        return True
+
+    def delete(self, bucket, key):
+        with self._lock:
+            self._objects.pop((bucket, key), None)
+
+    def url(self, bucket, key):
+        return "memory://{}/{}".format(bucket, key)
+
+
+class LocalS3Client:
+    exceptions = _Exceptions
+
+    def __init__(self, root=MEMORY_ROOT):
+        """Keeps the objects in the root directory or in memory if root is MEMORY_ROOT."""
+        if root == MEMORY_ROOT:
+            self._storage = _MemoryStorage()
+        else:
+            self._storage = _DirectoryStorage(root)
+
+    @staticmethod
+    def _error(code, operation, error_class=ClientError):
+        return error_class({"Error": {"Code": code, "Message": code}}, operation)
+
+    @staticmethod
+    def _metadata(head):
+        etag, size, last_modified = head
+        return dict(ETag=etag, ContentLength=size, LastModified=last_modified)
+
+    def head_object(self, Bucket, Key, **kwargs):
+        head = self._storage.head(Bucket, Key)
+        if head is None:
+            raise self._error("404", "HeadObject")
+        return self._metadata(head)
+
+    def get_object(self, Bucket, Key, Range=None, IfNoneMatch=None, **kwargs):
+        head = self._storage.head(Bucket, Key)
+        if head is None:
+            raise self._error("NoSuchKey", "GetObject", _Exceptions.NoSuchKey)
+        metadata = self._metadata(head)
+        if IfNoneMatch is not None and IfNoneMatch == metadata["ETag"]:
+            raise self._error("304", "GetObject")
+        if Range:
+            start, end = Range[len("bytes=") :].split("-")
+            start, end = int(start), int(end)
+            if start >= metadata["ContentLength"]:
+                raise self._error("InvalidRange", "GetObject")
+            data = self._storage.get(Bucket, Key, start, end)
+        else:
+            data = self._storage.get(Bucket, Key)
+        return dict(metadata, Body=BytesIO(data), ContentLength=len(data))
+
+    def put_object(self, Body, Bucket, Key, IfNoneMatch=None, **kwargs):
+        data = Body if isinstance(Body, bytes) else Body.read()
+        if not self._storage.put(Bucket, Key, data, exclusive=IfNoneMatch == "*"):
+            raise self._error("PreconditionFailed", "PutObject")
+        etag = self._storage.head(Bucket, Key)[0]
+        return dict(ResponseMetadata=dict(HTTPStatusCode=200), ETag=etag)
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._storage.delete(Bucket, Key)
+        return dict(ResponseMetadata=dict(HTTPStatusCode=204))
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return self._storage.url(Params["Bucket"], Params["Key"])
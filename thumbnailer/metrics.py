@@ -0,0 +1,133 @@
+"""
+Lightweight per request metrics: stage durations, sizes and properties,
+emitted as one log line in CloudWatch Embedded Metric Format (EMF) at the end of the request.
+
+See https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+"""
+
+from os import getenv
+from time import perf_counter, time
+from contextlib import contextmanager
+from json import dumps as json_dumps
+import sys
+import threading
+
+METRICS_ENABLED = getenv("METRICS_ENABLED", "1") != "0"
+METRICS_NAMESPACE = getenv("METRICS_NAMESPACE", "Thumbnailer")
+DIMENSION = "Operation"
+
+MILLISECONDS = "Milliseconds"
+BYTES = "Bytes"
+COUNT = "Count"
+NONE = "None"
+
+_local = threading.local()
+_cold_start = True
+
+
+class RequestMetrics:
+    def __init__(self, operation="unknown"):
+        self._values = {}
+        self._units = {}
+        self._properties = {DIMENSION: operation}
+
+    def put(self, name, value, unit=NONE):
+        self._values[name] = value
+        self._units[name] = unit
+
+    def add(self, name, value, unit=NONE):
+        """Adds the value to the metric, e.g. duration of a stage run many times."""
+        self.put(name, self._values.get(name, 0) + value, unit)
+
+    def set_property(self, name, value):
+        self._properties[name] = value
+
+    def to_emf(self):
+        metrics = [
+            dict(Name=name, Unit=self._units[name]) for name in sorted(self._values)
+        ]
+        document = dict(
+            _aws=dict(
+                Timestamp=int(time() * 1000),
+                CloudWatchMetrics=[
+                    dict(
+                        Namespace=METRICS_NAMESPACE,
+                        Dimensions=[[DIMENSION]],
+                        Metrics=metrics,
+                    )
+                ],
+            )
+        )
+        document.update(self._properties)
+        document.update(self._values)
+        return json_dumps(document)
+
+
+class _NoMetrics(RequestMetrics):
+    """Ignores metrics put outside of a request (or in other threads)."""
+
+    def put(self, name, value, unit=NONE):
+        pass
+
+    def set_property(self, name, value):
+        pass
+
+
+_no_metrics = _NoMetrics()
+
+
+def begin_request(operation="unknown"):
+    """Starts collecting metrics of a request in the current thread, see end_request."""
+    global _cold_start
+    request_metrics = RequestMetrics(operation) if METRICS_ENABLED else _no_metrics
+    request_metrics.put("ColdStart", int(_cold_start), COUNT)
+    _cold_start = False
+    _local.metrics = request_metrics
+    return request_metrics
+
+
+def end_request():
+    """Emits metrics of the request started in the current thread."""
+    request_metrics = current()
+    _local.metrics = None
+    if request_metrics is not _no_metrics:
+        # one write, so that the documents of requests ending in other threads are not interleaved
+        sys.stdout.write(request_metrics.to_emf() + "\n")
+
+
+@contextmanager
+def request(operation="unknown"):
+    """Collects metrics of a request in the with block (e.g. in a worker thread) and emits them,
+    metrics of the request started before in the current thread are collected again afterwards.
+    """
+    previous = getattr(_local, "metrics", None)
+    request_metrics = begin_request(operation)
+    try:
+        yield request_metrics
+    finally:
+        end_request()
+        _local.metrics = previous
+
+
+def current():
+    return getattr(_local, "metrics", None) or _no_metrics
+
+
+def put_metric(name, value, unit=NONE):
+    current().put(name, value, unit)
+
+
+def set_property(name, value):
+    current().set_property(name, value)
+
+
+@contextmanager
+def timed(name):
+    """Adds the duration (of the with block or decorated function) to {name}Time metric."""
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        current().add(
+            "{}Time".format(name), (perf_counter() - started) * 1000, MILLISECONDS
+        )
@@ -0,0 +1,140 @@
+"""
+Low quality placeholders shown before the thumbnails are loaded:
+BlurHash (see https://github.com/woltapp/blurhash), tiny preview and dominant color,
+computed from a small proxy of the image (see image_editor.placeholder_image_data).
+"""
+
+from os import getenv
+from io import BytesIO
+from base64 import b64encode
+import numpy as np
+from pydantic import BaseModel
+from PIL import Image
+
+# long edge of the proxy image, the image is decoded scaled down (JPEG) to at least this size
+PLACEHOLDER_PROXY_SIZE = 64
+# BlurHash components, horizontal and vertical
+BLURHASH_COMPONENTS = (
+    int(getenv("BLURHASH_COMPONENTS_X", 4)),
+    int(getenv("BLURHASH_COMPONENTS_Y", 3)),
+)
+# long edge of the preview (WebP data URI)
+PREVIEW_SIZE = int(getenv("PREVIEW_SIZE", 16))
+PREVIEW_QUALITY = int(getenv("PREVIEW_QUALITY", 50))
+# bits per channel of the colors counted to find the dominant one
+DOMINANT_COLOR_BITS = 4
+
+# settings affecting the placeholders, used to derive cache keys
+PLACEHOLDER_SETTINGS = dict(
+    proxy=PLACEHOLDER_PROXY_SIZE,
+    blurhash=BLURHASH_COMPONENTS,
+    preview=PREVIEW_SIZE,
+    preview_quality=PREVIEW_QUALITY,
+    dominant_color_bits=DOMINANT_COLOR_BITS,
+)
+
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+class Placeholder(BaseModel):
+    # of the image, as displayed (EXIF orientation applied)
+    width: int
+    height: int
+    blurhash: str
+    # CSS hex color, e.g. #aabbcc
+    dominant_color: str
+    # data URI
+    preview: str
+
+
+def placeholder(im, size):
+    """Returns Placeholder of the image (RGB proxy, see PLACEHOLDER_PROXY_SIZE)
+    of the original image of size (width, height).
+    """
+    pixels = np.asarray(im, dtype=np.uint8)
+    return Placeholder(
+        width=size[0],
+        height=size[1],
+        blurhash=blurhash(pixels),
+        dominant_color=dominant_color(pixels),
+        preview=preview(im),
+    )
+
+
+def blurhash(pixels, components=BLURHASH_COMPONENTS):
+    """Returns BlurHash of RGB pixels (height x width x 3 uint8 array)."""
+    nx, ny = components
+    height, width = pixels.shape[:2]
+    linear = _srgb_to_linear(pixels.astype(np.float64) / 255.0)
+    cos_x = np.cos(np.pi * np.outer(np.arange(nx), np.arange(width)) / width)
+    cos_y = np.cos(np.pi * np.outer(np.arange(ny), np.arange(height)) / height)
+    # all the components at once, (ny, nx, 3)
+    factors = np.einsum("jy,ix,yxc->jic", cos_y, cos_x, linear) * (
+        2.0 / (width * height)
+    )
+    factors[0, 0] /= 2
+    factors = factors.reshape(ny * nx, 3)
+    dc, ac = factors[0], factors[1:]
+
+    result = _encode83((nx - 1) + (ny - 1) * 9, 1)
+    if len(ac):
+        quantised_max = int(max(0, min(82, np.floor(np.abs(ac).max() * 166 - 0.5))))
+        maximum = (quantised_max + 1) / 166
+    else:
+        quantised_max, maximum = 0, 1.0
+    result += _encode83(quantised_max, 1)
+    r, g, b = (_linear_to_srgb(value) for value in dc)
+    result += _encode83((r << 16) + (g << 8) + b, 4)
+    scaled = ac / maximum
+    quantised = np.clip(
+        np.floor(np.sign(scaled) * np.sqrt(np.abs(scaled)) * 9 + 9.5), 0, 18
+    ).astype(int)
+    for qr, qg, qb in quantised:
+        result += _encode83(qr * 19 * 19 + qg * 19 + qb, 2)
+    return result
+
+
+def dominant_color(pixels):
+    """Returns CSS hex color of the most frequent (quantized) color of RGB pixels."""
+    pixels = pixels.reshape(-1, 3)
+    shift = 8 - DOMINANT_COLOR_BITS
+    quantised = (pixels >> shift).astype(np.intp)
+    index = (
+        quantised[:, 0] << (2 * DOMINANT_COLOR_BITS)
+        | quantised[:, 1] << DOMINANT_COLOR_BITS
+        | quantised[:, 2]
+    )
+    counts = np.bincount(index, minlength=1 << (3 * DOMINANT_COLOR_BITS))
+    # mean of the pixels of the most frequent color, not the center of its bin
+    color = pixels[index == counts.argmax()].mean(axis=0)
+    return "#{:02x}{:02x}{:02x}".format(*np.round(color).astype(int))
+
+
+def preview(im):
+    """Returns data URI of the image resized to PREVIEW_SIZE, encoded as WebP."""
+    im = im.copy()
+    im.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE), resample=Image.BOX)
+    output = BytesIO()
+    im.save(output, "WEBP", quality=PREVIEW_QUALITY, method=6)
+    return "data:image/webp;base64,{}".format(
+        b64encode(output.getvalue()).decode("ascii")
+    )
+
+
+def _encode83(value, length):
+    return "".join(
+        _BASE83[(int(value) // 83 ** (length - i - 1)) % 83] for i in range(length)
+    )
+
+
+def _srgb_to_linear(values):
+    return np.where(
+        values <= 0.04045, values / 12.92, ((values + 0.055) / 1.055) ** 2.4
+    )
+
+
+def _linear_to_srgb(value):
+    value = min(1.0, max(0.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
@@ -0,0 +1,149 @@
+"""
+Pre-renders derivatives of new images to the derivative cache,
+triggered by S3 ObjectCreated event notifications, directly or via SQS.
+"""
+
+from os import getenv
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from s3_event_type import S3Event, SQSEvent
+from config import handle_error
+import metrics
+from vfile import S3File
+from image_editor import (
+    batch_image_data,
+    output_format_name,
+    encoder_settings,
+    content_type,
+    ImageTooLargeException,
+    check_input_size,
+)
+from derivative_cache import derivative_cache, derivative_key
+
+logger = logging.getLogger(__name__)
+
+
+# comma separated long edges, e.g. "300,800"
+PRERENDER_LONG_EDGES = [
+    int(size) for size in getenv("PRERENDER_LONG_EDGES", "").split(",") if size
+]
+# comma separated widths and heights, e.g. "200x200,400x300"
+PRERENDER_FITS = [
+    tuple(int(pixels) for pixels in size.split("x"))
+    for size in getenv("PRERENDER_FITS", "").split(",")
+    if size
+]
+# comma separated output formats, e.g. "jpeg,webp"
+PRERENDER_FORMATS = [
+    output_format_name(name)
+    for name in getenv("PRERENDER_FORMATS", "jpeg").split(",")
+    if name
+]
+# number of records processed at the same time
+PRERENDER_CONCURRENCY = int(getenv("PRERENDER_CONCURRENCY", 4))
+
+SQS_EVENT_SOURCE = "aws:sqs"
+S3_EVENT_SOURCE = "aws:s3"
+S3_OBJECT_CREATED_EVENT_PREFIX = "ObjectCreated:"
+
+DERIVATIVE_CACHE = derivative_cache()
+
+
+def prerender(uri):
+    """Renders configured derivatives of the image and stores them in the derivative cache.
+
+    The image is decoded once for each of PRERENDER_FORMATS, see image_editor.batch_image_data.
+    The cache keys are the same as of the derivatives rendered on request.
+
+    Metrics are emitted for each image, records are processed in worker threads (see records_handler).
+    """
+    with metrics.request("prerender"):
+        _prerender(uri)
+
+
+def _prerender(uri):
+    if DERIVATIVE_CACHE is None:
+        logger.warning("Derivative cache not configured, not pre-rendering")
+        return
+    if uri.startswith(DERIVATIVE_CACHE.uri_prefix):
+        logger.info("Not pre-rendering derivative {}".format(uri))
+        return
+    source = S3File(uri)
+    etag = source.etag()
+    check_input_size(source.size())
+    data = source.read()
+    count = 0
+    for output_format in PRERENDER_FORMATS:
+        resized, fitted = batch_image_data(
+            data, PRERENDER_LONG_EDGES, PRERENDER_FITS, output_format=output_format
+        )
+        derivatives = [
+            (("thumbnail", (long_edge_pixels,)), thumb_data)
+            for long_edge_pixels, thumb_data in zip(PRERENDER_LONG_EDGES, resized)
+        ] + [
+            (("fit", (width, height)), thumb_data)
+            for (width, height), thumb_data in zip(PRERENDER_FITS, fitted)
+        ]
+        settings = encoder_settings(output_format)
+        for (operation, params), thumb_data in derivatives:
+            key = derivative_key(uri, etag, operation, params, settings)
+            if not DERIVATIVE_CACHE.put(
+                key, thumb_data, content_type=content_type(output_format)
+            ):
+                raise IOError("Failed caching {}".format(DERIVATIVE_CACHE.uri(key)))
+        count += len(derivatives)
+    logger.info("Pre-rendered {} derivatives of {}".format(count, uri))
+
+
+def _prerender_s3_event(s3_event):
+    for record in s3_event.Records:
+        if record.eventSource != S3_EVENT_SOURCE:
+            continue
+        if not record.eventName.startswith(S3_OBJECT_CREATED_EVENT_PREFIX):
+            continue
+        prerender(record.uri)
+
+
+def _prerender_sqs_record(record):
+    """Returns True if processed successfully."""
+    try:
+        _prerender_s3_event(S3Event.parse_raw(record.body))
+        return True
+    except ImageTooLargeException as e:
+        # retrying would not help
+        logger.warning("Not pre-rendering {}: {}".format(record.messageId, e))
+        return True
+    except Exception as e:
+        handle_error(e, "Failed processing message {}".format(record.messageId))
+        return False
+
+
+def records_handler(event):
+    """Handles S3 event notification or SQS event with S3 event notifications.
+
+    Records are processed concurrently.
+    For SQS event returns batch response with the messages that failed,
+    see https://docs.aws.amazon.com/lambda/latest/dg/with-sqs.html#services-sqs-batchfailurereporting
+    For S3 event raises exception if any of the records failed.
+    """
+    records = event.get("Records") or []
+    if records and records[0].get("eventSource") == SQS_EVENT_SOURCE:
+        sqs_event = SQSEvent(**event)
+        with ThreadPoolExecutor(max_workers=PRERENDER_CONCURRENCY) as executor:
+            results = list(executor.map(_prerender_sqs_record, sqs_event.Records))
+        failures = [
+            dict(itemIdentifier=record.messageId)
+            for record, succeeded in zip(sqs_event.Records, results)
+            if not succeeded
+        ]
+        return dict(batchItemFailures=failures)
+
+    s3_event = S3Event(**event)
+    with ThreadPoolExecutor(max_workers=PRERENDER_CONCURRENCY) as executor:
+        # raises the first exception, after all the records are processed
+        list(
+            executor.map(
+                lambda record: _prerender_s3_event(S3Event(Records=[record])),
+                s3_event.Records,
+            )
+        )
@@ -16,6 +16,33 @@ class ResultResponse(Response):
     statusCode: int = HTTPStatus.OK.value
 
 
+class FoundResponse(Response):
+    statusCode: int = HTTPStatus.FOUND.value
+
+    def __init__(self, location, headers={}):
+        super().__init__()
+
+        self.headers = dict(headers, Location=location)
+
+
+class SeeOtherResponse(Response):
+    statusCode: int = HTTPStatus.SEE_OTHER.value
+
+    def __init__(self, location, headers={}):
+        super().__init__()
+
+        self.headers = dict(headers, Location=location)
+
+
+class NotModifiedResponse(Response):
+    statusCode: int = HTTPStatus.NOT_MODIFIED.value
+
+    def __init__(self, headers={}):
+        super().__init__()
+
+        self.headers = dict(headers)
+
+
 class ServerErrorResponse(Response):
     statusCode: int = HTTPStatus.INTERNAL_SERVER_ERROR
 
@@ -32,6 +59,23 @@ class ForbiddenResponse(Response):
     statusCode: int = HTTPStatus.FORBIDDEN.value
 
 
+class UnprocessableEntityResponse(Response):
+    statusCode: int = HTTPStatus.UNPROCESSABLE_ENTITY.value
+
+
+class BadGatewayResponse(Response):
+    statusCode: int = HTTPStatus.BAD_GATEWAY.value
+
+
+class ServiceUnavailableResponse(Response):
+    statusCode: int = HTTPStatus.SERVICE_UNAVAILABLE.value
+
+    def __init__(self, retry_after):
+        super().__init__()
+
+        self.headers = {"Retry-After": str(retry_after)}
+
+
 class JSONResultResponse(ResultResponse):
     headers: Dict[str, str] = {"Content-Type": "application/json"}
     body: Optional[str] = ""
@@ -51,6 +95,6 @@ class BinaryResultResponse(ResultResponse):
         super().__init__()
 
         self.isBase64Encoded = True
-        headers["Content-Type"] = content_type
-        self.headers = headers
-        self.body = b64encode(data).decode("utf-8")
+        self.headers = dict(headers, **{"Content-Type": content_type})
+        # base64 is ASCII, decoding it does not need to check for multi-byte sequences
+        self.body = b64encode(data).decode("ascii")
@@ -0,0 +1,45 @@
+from typing import List, Optional
+from urllib.parse import unquote_plus
+from pydantic import BaseModel, ValidationError
+
+
+class S3Bucket(BaseModel):
+    name: str
+
+
+class S3Object(BaseModel):
+    key: str
+    eTag: Optional[str] = None
+
+
+class S3Entity(BaseModel):
+    bucket: S3Bucket
+    object: S3Object
+
+
+class S3EventRecord(BaseModel):
+    eventSource: str
+    eventName: str
+    s3: S3Entity
+
+    @property
+    def uri(self):
+        # keys in S3 event notifications are URL encoded
+        return "s3://{}/{}".format(
+            self.s3.bucket.name, unquote_plus(self.s3.object.key)
+        )
+
+
+class S3Event(BaseModel):
+    # S3 test event (sent when the notification is configured) has no records
+    Records: List[S3EventRecord] = []
+
+
+class SQSRecord(BaseModel):
+    messageId: str
+    eventSource: str
+    body: str
+
+
+class SQSEvent(BaseModel):
+    Records: List[SQSRecord]
@@ -0,0 +1,199 @@
+"""
+ASGI application serving the API in a long-running process (e.g. in a container),
+requests are handled by app.lambda_handler, as API Gateway events, in a pool of worker threads.
+
+Pillow releases the GIL when resizing and encoding, and so does botocore when waiting for S3,
+requests are handled concurrently by SERVER_WORKERS threads.
+At most SERVER_QUEUE_SIZE more requests wait for a worker, others are rejected with 503.
+Renders are also admitted against RENDER_MEMORY_BUDGET (see admission),
+so that the workers do not decode more big images at the same time than fit in memory.
+
+Run with any ASGI server, e.g.:
+
+    pip install -r requirements-server.txt
+    uvicorn server:app --app-dir thumbnailer --timeout-graceful-shutdown 30
+"""
+
+import os
+
+# X-Ray segments are created by Lambda, there are none to add subsegments to
+os.environ.setdefault("AWS_XRAY_SDK_ENABLED", "false")
+
+import asyncio
+import logging
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from json import dumps as json_dumps
+from app import lambda_handler, match_resource
+
+logger = logging.getLogger(__name__)
+
+
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", os.cpu_count() or 1))
+SERVER_QUEUE_SIZE = int(os.getenv("SERVER_QUEUE_SIZE", SERVER_WORKERS * 2))
+# seconds a client should wait before retrying rejected request
+SERVER_RETRY_AFTER = int(os.getenv("SERVER_RETRY_AFTER", 1))
+# the biggest accepted request body (batch request)
+SERVER_BODY_MAX_SIZE = int(os.getenv("SERVER_BODY_MAX_SIZE", 64 * 1024))
+
+
+class Server:
+    def __init__(self, workers=SERVER_WORKERS, queue_size=SERVER_QUEUE_SIZE):
+        self._workers = workers
+        self._queue_size = queue_size
+        self._executor = None
+        # requests are rejected after the shutdown started
+        self._stopping = False
+        # requests handled or waiting for a worker (or receiving the body), changed only in the event loop
+        self._pending = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._workers, thread_name_prefix="worker"
+        )
+        logger.info("Started {} workers".format(self._workers))
+
+    async def _stop(self):
+        # waits for the requests being handled
+        self._stopping = True
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, executor.shutdown, True)
+        logger.info("Stopped workers")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self._stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        if self._stopping:
+            await _send_response(send, _unavailable_response())
+            return
+        if self._executor is None:
+            # the ASGI server does not support lifespan
+            self._start()
+        path = scope.get("raw_path") or scope["path"].encode("utf-8")
+        match = match_resource(scope["method"], path.decode("latin-1").split("?")[0])
+        if match is None:
+            await _send_response(send, _error_response(HTTPStatus.NOT_FOUND))
+            return
+        if self._pending >= self._workers + self._queue_size:
+            logger.warning("Overloaded, {} requests pending".format(self._pending))
+            await _send_response(send, _unavailable_response())
+            return
+        # counted already while receiving the body, which may be slow
+        self._pending += 1
+        try:
+            body = await _receive_body(receive)
+            if body is None:
+                await _send_response(
+                    send, _error_response(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                )
+                return
+            try:
+                body = body.decode("utf-8") if body else None
+            except UnicodeDecodeError:
+                await _send_response(send, _error_response(HTTPStatus.BAD_REQUEST))
+                return
+            if self._stopping:
+                await _send_response(send, _unavailable_response())
+                return
+            resource, path_parameters = match
+            event = dict(
+                resource=resource,
+                path=scope["path"],
+                httpMethod=scope["method"],
+                headers=_headers(scope),
+                pathParameters=path_parameters,
+                body=body,
+            )
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(
+                self._executor, lambda_handler, event, None
+            )
+        finally:
+            self._pending -= 1
+        await _send_response(send, response)
+
+
+def _headers(scope):
+    headers = {}
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1")
+        value = value.decode("latin-1")
+        headers[name] = (
+            "{},{}".format(headers[name], value) if name in headers else value
+        )
+    return headers
+
+
+async def _receive_body(receive):
+    """Returns the request body or None if bigger than SERVER_BODY_MAX_SIZE."""
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > SERVER_BODY_MAX_SIZE:
+            return None
+        if not message.get("more_body", False):
+            return body
+
+
+def _error_response(status):
+    return dict(
+        statusCode=status.value,
+        headers={"Content-Type": "application/json"},
+        body=json_dumps(dict(message=status.phrase)),
+        isBase64Encoded=False,
+    )
+
+
+def _unavailable_response():
+    response = _error_response(HTTPStatus.SERVICE_UNAVAILABLE)
+    response["headers"]["Retry-After"] = str(SERVER_RETRY_AFTER)
+    return response
+
+
+async def _send_response(send, response):
+    """Sends API Gateway (proxy integration) response."""
+    body = response.get("body") or ""
+    if response.get("isBase64Encoded"):
+        body = b64decode(body)
+    else:
+        body = body.encode("utf-8")
+    # lowercased, as required by ASGI
+    headers = [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in (response.get("headers") or {}).items()
+    ]
+    headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    await send(
+        {
+            "type": "http.response.start",
+            "status": int(response["statusCode"]),
+            "headers": headers,
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+app = Server()
@@ -0,0 +1,166 @@
+"""
+Coalesces concurrent identical renders (single flight),
+only one of the callers with the same key renders, the others wait for its result.
+
+Callers in the same process wait for the rendering thread.
+Callers in other processes (containers) are excluded with a lock file created atomically
+(S3 conditional write) and poll for the result, after timeout they render it themselves,
+so that a crashed renderer does not block the others for long.
+They render it also if the lock is released without the result (e.g. the renderer failed).
+The lock is removed by a waiter only if it is older than SINGLE_FLIGHT_LOCK_TIMEOUT (stale),
+not while the renderer may still be running.
+"""
+
+from os import getenv
+from datetime import datetime, timezone
+from time import monotonic, sleep
+import threading
+import logging
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+import metrics
+from vfile import vfile, ForbiddenException, NotFoundException
+
+logger = logging.getLogger(__name__)
+
+
+# seconds to wait for the result rendered by another caller
+SINGLE_FLIGHT_TIMEOUT = float(getenv("SINGLE_FLIGHT_TIMEOUT", 5))
+# seconds between lookups of the result rendered in another process
+SINGLE_FLIGHT_POLL_INTERVAL = float(getenv("SINGLE_FLIGHT_POLL_INTERVAL", 0.25))
+# seconds a lock is held at most (the function timeout, see template.yaml), older locks are stale
+SINGLE_FLIGHT_LOCK_TIMEOUT = float(getenv("SINGLE_FLIGHT_LOCK_TIMEOUT", 10))
+
+# failures of the lock storage, others (e.g. invalid parameters) are raised
+_LOCK_ERRORS = (
+    ClientError,
+    ForbiddenException,
+    ConnectionError,
+    HTTPClientError,
+    OSError,
+)
+
+
+class SingleFlight:
+    def __init__(
+        self,
+        lock_uri_prefix=None,
+        timeout=SINGLE_FLIGHT_TIMEOUT,
+        poll_interval=SINGLE_FLIGHT_POLL_INTERVAL,
+        lock_timeout=SINGLE_FLIGHT_LOCK_TIMEOUT,
+    ):
+        self._lock_uri_prefix = lock_uri_prefix
+        self._timeout = timeout
+        self._poll_interval = poll_interval
+        self._lock_timeout = lock_timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    @property
+    def lock_uri_prefix(self):
+        return self._lock_uri_prefix
+
+    def run(self, key, lookup, render):
+        """Returns the result of lookup (if not None) or render.
+
+        lookup returns the result rendered (and stored) by another caller or None,
+        render is called only if no other caller is rendering the same key,
+        or if it does not finish within the timeout.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            first = flight is None
+            if first:
+                flight = self._flights[key] = threading.Event()
+        if not first:
+            finished = flight.wait(self._timeout)
+            return self._lookup_or_render(key, lookup, render, timed_out=not finished)
+        try:
+            return self._run_locked(key, lookup, render)
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.set()
+
+    def _run_locked(self, key, lookup, render):
+        if not self._lock_uri_prefix:
+            metrics.set_property("SingleFlight", "render")
+            return render()
+        lock = vfile(self._lock_uri_prefix + key)
+        try:
+            locked = lock.create(b"")
+        except _LOCK_ERRORS as e:
+            logger.warning("Failed locking {}: {}".format(lock.uri, e))
+            metrics.set_property("SingleFlight", "render")
+            return render()
+        if locked:
+            metrics.set_property("SingleFlight", "render")
+            try:
+                return render()
+            finally:
+                _unlock(lock)
+        logger.info("Waiting for {} rendered by another process".format(key))
+        deadline = monotonic() + self._timeout
+        while monotonic() < deadline:
+            sleep(self._poll_interval)
+            result = lookup()
+            if result is not None:
+                metrics.set_property("SingleFlight", "wait")
+                return result
+            if not _is_locked(lock):
+                # e.g. the other process failed to render
+                return self._lookup_or_render(key, lookup, render, timed_out=False)
+        result = self._lookup_or_render(key, lookup, render, timed_out=True)
+        # the lock is stale if the other process crashed, not if it is still rendering
+        if _lock_age(lock) > self._lock_timeout:
+            logger.warning("Removing stale lock {}".format(lock.uri))
+            _unlock(lock)
+        return result
+
+    def _lookup_or_render(self, key, lookup, render, timed_out):
+        """Returns the result of lookup or render if there is none,
+        after waiting for another caller which timed out or finished (released the lock) without the result.
+        """
+        result = lookup()
+        if result is not None:
+            metrics.set_property("SingleFlight", "wait")
+            return result
+        if timed_out:
+            logger.warning(
+                "Timed out waiting {}s for {}, rendering".format(self._timeout, key)
+            )
+            metrics.set_property("SingleFlight", "timeout")
+            metrics.put_metric("SingleFlightTimeout", 1, metrics.COUNT)
+        else:
+            logger.warning("{} released without result, rendering".format(key))
+            metrics.set_property("SingleFlight", "released")
+            metrics.put_metric("SingleFlightReleased", 1, metrics.COUNT)
+        return render()
+
+
+def _is_locked(lock):
+    """Returns True if the lock exists, also if it cannot be checked."""
+    try:
+        return lock.exists()
+    except _LOCK_ERRORS as e:
+        logger.warning("Failed checking {}: {}".format(lock.uri, e))
+        return True
+
+
+def _lock_age(lock):
+    """Returns seconds since the lock was created, 0 if it does not exist or cannot be checked."""
+    try:
+        # not the cached HEAD response of the lock
+        created = vfile(lock.uri).last_modified()
+    except NotFoundException:
+        return 0
+    except _LOCK_ERRORS as e:
+        logger.warning("Failed checking {}: {}".format(lock.uri, e))
+        return 0
+    return (datetime.now(timezone.utc) - created).total_seconds()
+
+
+def _unlock(lock):
+    try:
+        lock.remove()
+    except _LOCK_ERRORS as e:
+        logger.warning("Failed unlocking {}: {}".format(lock.uri, e))
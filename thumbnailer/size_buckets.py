@@ -0,0 +1,92 @@
+"""
+Snaps requested sizes to buckets, so that clients asking for nearly the same size
+share the derivatives cached by CloudFront and in the derivative cache.
+
+A size is snapped up to the smallest bucket that is not smaller,
+the client scales the (slightly bigger) image down if needed.
+"""
+
+from os import getenv
+from image_editor import LONG_EDGE_MIN, LONG_EDGE_MAX
+
+# comma separated long edges (pixels), e.g. DPR aware "160,240,320,480,640,960,1280,1920"
+SIZE_BUCKETS = sorted(
+    int(size) for size in getenv("SIZE_BUCKETS", "").split(",") if size
+)
+# the buckets are redirected to, they must be valid sizes
+if any(size < LONG_EDGE_MIN or size > LONG_EDGE_MAX for size in SIZE_BUCKETS):
+    raise ValueError(
+        "SIZE_BUCKETS {} not within {} and {}".format(
+            ",".join(map(str, SIZE_BUCKETS)), LONG_EDGE_MIN, LONG_EDGE_MAX
+        )
+    )
+# used if SIZE_BUCKETS is not set, sizes are snapped up to its multiples, e.g. 50
+SIZE_BUCKET_STEP = int(getenv("SIZE_BUCKET_STEP", 0))
+# redirect - redirects to the bucketed size, render - renders the bucketed size
+SIZE_BUCKET_MODES = ("redirect", "render")
+SIZE_BUCKET_MODE = getenv("SIZE_BUCKET_MODE", "redirect")
+if SIZE_BUCKET_MODE not in SIZE_BUCKET_MODES:
+    raise ValueError(
+        "SIZE_BUCKET_MODE {} not in: {}".format(
+            SIZE_BUCKET_MODE, ", ".join(SIZE_BUCKET_MODES)
+        )
+    )
+
+
+def enabled():
+    return bool(SIZE_BUCKETS) or SIZE_BUCKET_STEP > 0
+
+
+def bucket_long_edge(pixels):
+    """Returns the bucket of the long edge (pixels).
+
+    Sizes not within LONG_EDGE_MIN and LONG_EDGE_MAX or bigger than the biggest bucket
+    are returned as they are.
+    """
+    if pixels < LONG_EDGE_MIN or pixels > LONG_EDGE_MAX:
+        return pixels
+    if SIZE_BUCKETS:
+        return next((size for size in SIZE_BUCKETS if size >= pixels), pixels)
+    if SIZE_BUCKET_STEP > 0:
+        size = -(-pixels // SIZE_BUCKET_STEP) * SIZE_BUCKET_STEP
+        return size if size <= LONG_EDGE_MAX else pixels
+    return pixels
+
+
+def bucket_fit(width, height):
+    """Returns the bucket (width, height) of the fitted size.
+
+    The long edge is snapped (see bucket_long_edge), the short one scaled to keep the aspect ratio.
+    """
+    long_edge = max(width, height)
+    bucket = bucket_long_edge(long_edge)
+    if bucket == long_edge:
+        return width, height
+    scale = bucket / long_edge
+    if width >= height:
+        return bucket, min(bucket, round(height * scale))
+    return min(bucket, round(width * scale)), bucket
+
+
+def canonical_location(resource, path_parameters, bucketed):
+    """Returns location (relative to the requested one) of the resource
+    with the path parameters replaced by bucketed ones.
+
+    The location is relative, so that it is valid behind CloudFront and API Gateway stage alike.
+    """
+    segments = resource.split("/")
+    changed = [
+        index
+        for index, segment in enumerate(segments)
+        if segment[1:-1] in bucketed
+        and str(bucketed[segment[1:-1]]) != path_parameters.get(segment[1:-1])
+    ]
+    if not changed:
+        return None
+    first = changed[0]
+    parameters = dict(path_parameters, **{k: str(v) for k, v in bucketed.items()})
+    tail = [
+        parameters[segment[1:-1]] if segment.startswith("{") else segment
+        for segment in segments[first:]
+    ]
+    return "../" * (len(segments) - 1 - first) + "/".join(tail)
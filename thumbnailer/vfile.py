@@ -1,13 +1,63 @@
 """
 Provides unified file interface to local file, AWS S3 object and HTTP(s) resource.
 """
+
 import os
 import logging
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from tempfile import SpooledTemporaryFile
 from aws_xray_sdk.core import xray_recorder
+import metrics
 
 logger = logging.getLogger(__name__)
 
 
+# S3 client configuration,
+# see https://botocore.amazonaws.com/v1/documentation/api/latest/reference/config.html
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 16))
+S3_CONNECT_TIMEOUT = float(os.getenv("S3_CONNECT_TIMEOUT", 2))
+S3_READ_TIMEOUT = float(os.getenv("S3_READ_TIMEOUT", 5))
+S3_MAX_ATTEMPTS = int(os.getenv("S3_MAX_ATTEMPTS", 3))
+# directory standing in for S3 (buckets are its subdirectories), "memory" to keep the objects in memory,
+# see local_s3, AWS S3 is used if not set
+S3_LOCAL_ROOT = os.getenv("S3_LOCAL_ROOT", "")
+
+# HTTP(S) connection pool configuration, see HttpFile
+HTTP_MAX_POOL_CONNECTIONS = int(os.getenv("HTTP_MAX_POOL_CONNECTIONS", 16))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 2))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 5))
+HTTP_MAX_ATTEMPTS = int(os.getenv("HTTP_MAX_ATTEMPTS", 3))
+# bigger HTTP(S) resources are not read
+HTTP_MAX_SIZE = int(os.getenv("HTTP_MAX_SIZE", 50 * 1024 * 1024))
+# unread rest of HTTP(S) responses up to this size is read, so that the connection is kept alive,
+# connections with bigger (or unknown) rest are closed
+HTTP_DRAIN_MAX_SIZE = 64 * 1024
+
+# files opened for streaming (see VFile.open) are kept in memory up to this size, in /tmp if bigger
+SPOOL_MAX_SIZE = int(os.getenv("SPOOL_MAX_SIZE", 8 * 1024 * 1024))
+READ_CHUNK_SIZE = 1024 * 1024
+
+# memory of the function in MB, set by Lambda runtime
+FUNCTION_MEMORY_SIZE = int(os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", 512))
+# part of the function memory used to cache S3 objects read in a warm container
+SOURCE_CACHE_MEMORY_RATIO = float(os.getenv("SOURCE_CACHE_MEMORY_RATIO", 0.2))
+# size of the cache in bytes, overrides SOURCE_CACHE_MEMORY_RATIO, 0 to disable caching
+SOURCE_CACHE_SIZE = int(
+    os.getenv(
+        "SOURCE_CACHE_SIZE",
+        FUNCTION_MEMORY_SIZE * 1024 * 1024 * SOURCE_CACHE_MEMORY_RATIO,
+    )
+)
+# bigger files are not cached, and streamed when opened (see VFile.open)
+SOURCE_CACHE_ENTRY_MAX_SIZE = int(
+    os.getenv("SOURCE_CACHE_ENTRY_MAX_SIZE", SOURCE_CACHE_SIZE // 4)
+)
+
+
 # TODO: make common base excetion class with message property?
 
 
@@ -63,10 +113,148 @@ class ForbiddenException(Exception):
         return self._message
 
 
+class TooLargeException(Exception):
+    def __init__(self, uri, max_size):
+        self._uri = uri
+        message = "{0} is bigger than {1} bytes".format(uri, max_size)
+        self._message = message
+        super(TooLargeException, self).__init__(uri, max_size)
+
+    @property
+    def uri(self):
+        return self._uri
+
+    @property
+    def message(self):
+        return self._message
+
+    def __str__(self):
+        return self._message
+
+
+class RedirectException(Exception):
+    """Redirect of HttpFile, not followed."""
+
+    def __init__(self, uri, location):
+        self._uri = uri
+        message = "{0} redirects to {1}".format(uri, location)
+        self._message = message
+        super(RedirectException, self).__init__(uri, location)
+
+    @property
+    def uri(self):
+        return self._uri
+
+    @property
+    def message(self):
+        return self._message
+
+    def __str__(self):
+        return self._message
+
+
+class UpstreamException(Exception):
+    """Error of the origin of HttpFile (e.g. 5xx) or failure to reach it."""
+
+    def __init__(self, uri, reason):
+        self._uri = uri
+        message = "Failed to read {0}: {1}".format(uri, reason)
+        self._message = message
+        super(UpstreamException, self).__init__(uri, reason)
+
+    @property
+    def uri(self):
+        return self._uri
+
+    @property
+    def message(self):
+        return self._message
+
+    def __str__(self):
+        return self._message
+
+
+class SourceCache:
+    """LRU cache of file contents with their ETags, bounded by the total size of the contents."""
+
+    def __init__(self, max_size, max_entry_size=None):
+        self._max_size = max_size
+        self._max_entry_size = min(max_size, max_entry_size or max_size)
+        self._size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @property
+    def max_entry_size(self):
+        return self._max_entry_size
+
+    @property
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, uri):
+        """Returns (etag, data) tuple or None if not cached."""
+        with self._lock:
+            entry = self._entries.get(uri)
+            if entry is not None:
+                self._entries.move_to_end(uri)
+            return entry
+
+    def put(self, uri, etag, data):
+        """Caches data, evicting the least recently used entries if needed.
+
+        Data bigger than max_entry_size is not cached.
+        """
+        with self._lock:
+            self._remove(uri)
+            if len(data) > self._max_entry_size:
+                return
+            while self._size + len(data) > self._max_size:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+            self._entries[uri] = (etag, data)
+            self._size += len(data)
+
+    def remove(self, uri):
+        with self._lock:
+            self._remove(uri)
+
+    def _remove(self, uri):
+        entry = self._entries.pop(uri, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        return dict(
+            hits=self.hits, misses=self.misses, entries=len(self), size=self.size
+        )
+
+
+source_cache = SourceCache(SOURCE_CACHE_SIZE, SOURCE_CACHE_ENTRY_MAX_SIZE)
+
+
 # factory method
 def vfile(path_or_uri):
     if S3File.isS3URI(path_or_uri):
         return S3File(path_or_uri)
+    elif HttpFile.isHttpURI(path_or_uri):
+        return HttpFile(path_or_uri)
     elif LocalFile.isFileURI(path_or_uri):
         return LocalFile(path_or_uri)
     else:
@@ -89,6 +277,30 @@ class VFile:
         """
         raise NotImplementedError
 
+    def etag(self):
+        """Returns entity tag of the file, it changes when the content changes.
+
+        Returns None if the file has no validator, its derivatives are then neither cached nor validated.
+
+        Raises exception in case of error.
+        """
+        raise NotImplementedError
+
+    def last_modified(self):
+        """Returns time (datetime in UTC) of the last modification of the file.
+
+        Raises exception in case of error.
+        """
+        raise NotImplementedError
+
+    def size(self):
+        """Returns size of the content in bytes, read from the metadata (without reading the content),
+        None if not known.
+
+        Raises exception in case of error.
+        """
+        raise NotImplementedError
+
     def read(self, size=-1):
         """Reads the content from the beginning.
 
@@ -98,7 +310,34 @@ class VFile:
         """
         raise NotImplementedError
 
-    def write(self, data):
+    def open(self):
+        """Opens the content for reading.
+
+        Returns binary file (readable and seekable), close it when done.
+
+        Raises exception in case of error.
+        """
+        return BytesIO(self.read())
+
+    def read_range(self, offset, size):
+        """Reads size bytes starting at offset.
+
+        Returns less than size bytes if the end of the file is reached,
+        empty bytes if offset is beyond the end of the file.
+
+        Raises exception in case of error.
+        """
+        raise NotImplementedError
+
+    def write(self, data, content_type=None):
+        """Writes the content, content_type is stored if supported."""
+        raise NotImplementedError
+
+    def create(self, data, content_type=None):
+        """Writes the content only if the file does not exist (atomically).
+
+        Returns True if created, False if the file exists.
+        """
         raise NotImplementedError
 
     def remove(self):
@@ -131,6 +370,19 @@ class LocalFile(VFile):
         abs_path = os.path.abspath(self._path)
         return os.path.isfile(abs_path)
 
+    def etag(self):
+        abs_path = os.path.abspath(self._path)
+        st = os.stat(abs_path)
+        return "{:x}-{:x}".format(st.st_mtime_ns, st.st_size)
+
+    def last_modified(self):
+        abs_path = os.path.abspath(self._path)
+        return datetime.fromtimestamp(os.stat(abs_path).st_mtime, timezone.utc)
+
+    def size(self):
+        abs_path = os.path.abspath(self._path)
+        return os.stat(abs_path).st_size
+
     def read(self, size=-1):
         abs_path = os.path.abspath(self._path)
         fh = open(abs_path, "rb")
@@ -139,7 +391,17 @@ class LocalFile(VFile):
         fh.close()
         return data
 
-    def write(self, data):
+    def open(self):
+        abs_path = os.path.abspath(self._path)
+        return open(abs_path, "rb")
+
+    def read_range(self, offset, size):
+        abs_path = os.path.abspath(self._path)
+        with open(abs_path, "rb") as fh:
+            fh.seek(offset)
+            return fh.read(size)
+
+    def write(self, data, content_type=None):
         abs_path = os.path.abspath(self._path)
         if isinstance(data, bytes):
             fh = open(abs_path, "wb")
@@ -153,6 +415,16 @@ class LocalFile(VFile):
             logger.error("Failed writing to %s" % self.uri)
             return False
 
+    def create(self, data, content_type=None):
+        abs_path = os.path.abspath(self._path)
+        try:
+            fh = open(abs_path, "xb")
+        except FileExistsError:
+            return False
+        with fh:
+            fh.write(data)
+        return True
+
     def remove(self):
         abs_path = os.path.abspath(self._path)
         try:
@@ -185,18 +457,47 @@ class S3File(VFile):
     def key(self):
         return self._key
 
-    def __init__(self, uri):
-        if not S3File.isS3URI(uri):
-            raise InvalidURIException(uri, "s3://bucket/key")
+    @staticmethod
+    def init_client():
+        """Creates S3 client shared by all the instances.
+
+        Call it during the function initialization so that it is not created when handling the first request.
+        """
+        if not S3File._s3_client and S3_LOCAL_ROOT:
+            from local_s3 import LocalS3Client
+
+            logger.info("S3 stood in by {}".format(S3_LOCAL_ROOT))
+            S3File._s3_client = LocalS3Client(S3_LOCAL_ROOT)
         if not S3File._s3_client:
             import boto3
+            from botocore.config import Config
 
-            S3File._s3_client = boto3.client("s3")
+            config = Config(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                connect_timeout=S3_CONNECT_TIMEOUT,
+                read_timeout=S3_READ_TIMEOUT,
+                retries=dict(max_attempts=S3_MAX_ATTEMPTS),
+            )
+            S3File._s3_client = boto3.client("s3", config=config)
+
+    @staticmethod
+    def set_client(client):
+        """Sets S3 client shared by all the instances,
+        boto3 client or the one standing in for it (see local_s3).
+        """
+        S3File._s3_client = client
+
+    def __init__(self, uri):
+        if not S3File.isS3URI(uri):
+            raise InvalidURIException(uri, "s3://bucket/key")
+        S3File.init_client()
         VFile.__init__(self, uri)
         path = uri[len("s3://") :]
         i = path.index("/")
         self._bucket_name = path[:i]
         self._key = path[i + 1 :]
+        # HeadObject response, etag and last_modified need only one request
+        self._head_response = None
 
     def exists(self):
         # TODO: raise ForbiddenException
@@ -206,8 +507,100 @@ class S3File(VFile):
         except S3File._s3_client.exceptions.NoSuchKey:
             return False
 
+    def etag(self):
+        return self._head()["ETag"]
+
+    def last_modified(self):
+        return self._head()["LastModified"]
+
+    def size(self):
+        return self._head()["ContentLength"]
+
+    @xray_recorder.capture("S3File.head")
+    @metrics.timed("S3Head")
+    def _head(self):
+        if self._head_response is not None:
+            return self._head_response
+        try:
+            self._head_response = S3File._s3_client.head_object(
+                Bucket=self.bucket_name, Key=self.key
+            )
+            return self._head_response
+        except S3File._s3_client.exceptions.ClientError as e:
+            # HEAD response has no body, the error code is HTTP status code
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                logger.error("Failed to head %s: %s" % (self.uri, e))
+                raise NotFoundException(self.uri)
+            logger.error("Not allowed to head %s: %s" % (self.uri, e))
+            raise ForbiddenException(self.uri, "read")
+
     @xray_recorder.capture("S3File.read")
+    @metrics.timed("S3Get")
     def read(self, size=-1):
+        """Reads the content from the beginning.
+
+        The whole content is cached in source_cache (unless too big)
+        and revalidated with conditional GET (If-None-Match) when read again.
+        """
+        if size > 0:
+            return self._read(size)
+        cached = source_cache.get(self.uri)
+        obj = self._get_object(if_none_match=cached[0] if cached else None)
+        if obj is None:
+            source_cache.count(hit=True)
+            logger.info("Using cached %s" % self.uri)
+            return cached[1]
+        source_cache.count(hit=False)
+        data = obj["Body"].read()
+        source_cache.put(self.uri, obj["ETag"], data)
+        return data
+
+    @xray_recorder.capture("S3File.open")
+    @metrics.timed("S3Get")
+    def open(self):
+        """Opens the content for reading.
+
+        The content is cached as by read, unless too big (see SOURCE_CACHE_ENTRY_MAX_SIZE),
+        then it is streamed in chunks to a file spooled to /tmp if bigger than SPOOL_MAX_SIZE.
+        """
+        cached = source_cache.get(self.uri)
+        obj = self._get_object(if_none_match=cached[0] if cached else None)
+        if obj is None:
+            source_cache.count(hit=True)
+            metrics.set_property("SourceCache", "hit")
+            logger.info("Using cached %s" % self.uri)
+            return BytesIO(cached[1])
+        source_cache.count(hit=False)
+        metrics.set_property("SourceCache", "miss")
+        fh = obj["Body"]
+        if obj["ContentLength"] <= source_cache.max_entry_size:
+            data = fh.read()
+            source_cache.put(self.uri, obj["ETag"], data)
+            return BytesIO(data)
+        logger.info("Streaming %s (%d bytes)" % (self.uri, obj["ContentLength"]))
+        f = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        for chunk in iter(lambda: fh.read(READ_CHUNK_SIZE), b""):
+            f.write(chunk)
+        f.seek(0)
+        return f
+
+    @xray_recorder.capture("S3File.read_if_exists")
+    @metrics.timed("S3Get")
+    def read_if_exists(self):
+        """Reads the whole content, not cached in source_cache (e.g. derivatives, read once).
+
+        Returns None if the object does not exist, which is not an error (e.g. cache miss).
+        """
+        try:
+            obj = S3File._s3_client.get_object(Bucket=self.bucket_name, Key=self.key)
+        except S3File._s3_client.exceptions.NoSuchKey:
+            return None
+        except S3File._s3_client.exceptions.ClientError as e:
+            logger.error("Not allowed to read %s: %s" % (self.uri, e))
+            raise ForbiddenException(self.uri, "read")
+        return obj["Body"].read()
+
+    def _read(self, size=-1):
         try:
             obj = S3File._s3_client.get_object(Bucket=self.bucket_name, Key=self.key)
             fh = obj["Body"]
@@ -223,12 +616,56 @@ class S3File(VFile):
             logger.error("Not allowed to read %s: %s" % (self.uri, e))
             raise ForbiddenException(self.uri, "read")
 
-    @xray_recorder.capture("S3File.write")
-    def write(self, data):
+    def _get_object(self, if_none_match=None):
+        """Gets the object, conditionally if if_none_match (ETag) is set.
+
+        Returns GetObject response, None if not modified since if_none_match.
+        """
+        kwargs = dict(Bucket=self.bucket_name, Key=self.key)
+        if if_none_match:
+            kwargs["IfNoneMatch"] = if_none_match
+        try:
+            return S3File._s3_client.get_object(**kwargs)
+        except S3File._s3_client.exceptions.NoSuchKey as e:
+            source_cache.remove(self.uri)
+            logger.error("Failed to read %s: %s" % (self.uri, e))
+            raise NotFoundException(self.uri)
+        except S3File._s3_client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "304":
+                return None
+            source_cache.remove(self.uri)
+            logger.error("Not allowed to read %s: %s" % (self.uri, e))
+            raise ForbiddenException(self.uri, "read")
+
+    @xray_recorder.capture("S3File.read_range")
+    @metrics.timed("S3Get")
+    def read_range(self, offset, size):
+        byte_range = "bytes={}-{}".format(offset, offset + size - 1)
         try:
-            response = S3File._s3_client.put_object(
-                Body=data, Bucket=self.bucket_name, Key=self.key
+            obj = S3File._s3_client.get_object(
+                Bucket=self.bucket_name, Key=self.key, Range=byte_range
             )
+            return obj["Body"].read()
+        except S3File._s3_client.exceptions.NoSuchKey as e:
+            logger.error("Failed to read %s: %s" % (self.uri, e))
+            raise NotFoundException(self.uri)
+        except S3File._s3_client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "InvalidRange":
+                # offset is beyond the end of the object
+                return b""
+            logger.error("Not allowed to read %s: %s" % (self.uri, e))
+            raise ForbiddenException(self.uri, "read")
+
+    @xray_recorder.capture("S3File.write")
+    @metrics.timed("S3Put")
+    def write(self, data, content_type=None):
+        source_cache.remove(self.uri)
+        self._head_response = None
+        kwargs = dict(Body=data, Bucket=self.bucket_name, Key=self.key)
+        if content_type:
+            kwargs["ContentType"] = content_type
+        try:
+            response = S3File._s3_client.put_object(**kwargs)
             # TODO: throw if failed to write, make another exception type
             if response["ResponseMetadata"]["HTTPStatusCode"] == 200:
                 return True
@@ -240,7 +677,41 @@ class S3File(VFile):
             logger.error("Not allowed to write %s: %s" % (self.uri, e))
             raise ForbiddenException(self.uri, "write")
 
+    @xray_recorder.capture("S3File.create")
+    @metrics.timed("S3Put")
+    def create(self, data, content_type=None):
+        """Writes the object with conditional PUT (If-None-Match: *),
+        see https://docs.aws.amazon.com/AmazonS3/latest/userguide/conditional-writes.html
+        """
+        source_cache.remove(self.uri)
+        self._head_response = None
+        kwargs = dict(Body=data, Bucket=self.bucket_name, Key=self.key, IfNoneMatch="*")
+        if content_type:
+            kwargs["ContentType"] = content_type
+        try:
+            S3File._s3_client.put_object(**kwargs)
+            return True
+        except S3File._s3_client.exceptions.ClientError as e:
+            # 409 if there is a concurrent conditional write in progress
+            if e.response.get("Error", {}).get("Code") in (
+                "PreconditionFailed",
+                "ConditionalRequestConflict",
+            ):
+                return False
+            logger.error("Not allowed to write %s: %s" % (self.uri, e))
+            raise ForbiddenException(self.uri, "write")
+
+    def presigned_url(self, expires_in):
+        """Returns URL to GET the object without credentials, valid for expires_in seconds."""
+        return S3File._s3_client.generate_presigned_url(
+            "get_object",
+            Params=dict(Bucket=self.bucket_name, Key=self.key),
+            ExpiresIn=expires_in,
+        )
+
     def remove(self):
+        source_cache.remove(self.uri)
+        self._head_response = None
         response = S3File._s3_client.delete_object(
             Bucket=self.bucket_name, Key=self.key
         )
@@ -251,6 +722,249 @@ class S3File(VFile):
             return False
 
 
-# TODO: implement HTTPFile
+class HttpFile(VFile):
+    """Read only HTTP(S) resource.
+
+    Redirects are not followed, so that only the requested origin is accessed.
+    """
+
+    # connection pool shared by all the instances, connections are kept alive in a warm container
+    _http = None
+
+    @staticmethod
+    def isHttpURI(uri):
+        return (uri.startswith("http://") or uri.startswith("https://")) and uri.count(
+            "/"
+        ) > 2
+
+    @staticmethod
+    def init_pool():
+        """Creates connection pool shared by all the instances.
+
+        Call it during the function initialization so that it is not created when handling the first request.
+        """
+        if not HttpFile._http:
+            import urllib3
+
+            HttpFile._http = urllib3.PoolManager(
+                maxsize=HTTP_MAX_POOL_CONNECTIONS,
+                block=False,
+                timeout=urllib3.Timeout(
+                    connect=HTTP_CONNECT_TIMEOUT, read=HTTP_READ_TIMEOUT
+                ),
+                retries=urllib3.Retry(
+                    total=HTTP_MAX_ATTEMPTS - 1,
+                    redirect=False,
+                    raise_on_status=False,
+                    backoff_factor=0.1,
+                ),
+            )
+
+    def __init__(self, uri):
+        if not HttpFile.isHttpURI(uri):
+            raise InvalidURIException(uri, "https://host/path")
+        HttpFile.init_pool()
+        VFile.__init__(self, uri)
+        # HEAD response, etag and last_modified need only one request
+        self._head_response = None
+
+    def exists(self):
+        try:
+            self._head()
+            return True
+        except NotFoundException:
+            return False
+
+    def etag(self):
+        headers = self._head().headers
+        etag = headers.get("ETag")
+        if etag:
+            return etag
+        last_modified = headers.get("Last-Modified")
+        if not last_modified:
+            # the content may change without notice
+            return None
+        # weak, if the origin does not send ETag
+        return 'W/"{}-{}"'.format(last_modified, headers.get("Content-Length", ""))
+
+    def last_modified(self):
+        value = self._head().headers.get("Last-Modified")
+        try:
+            return parsedate_to_datetime(value) if value else None
+        except (TypeError, ValueError):
+            return None
+
+    def size(self):
+        # not sent by some origins, e.g. of dynamic content
+        value = self._head().headers.get("Content-Length")
+        try:
+            return int(value) if value else None
+        except ValueError:
+            return None
+
+    @xray_recorder.capture("HttpFile.head")
+    @metrics.timed("HttpHead")
+    def _head(self):
+        if self._head_response is None:
+            self._head_response = self._request("HEAD")
+        return self._head_response
+
+    @xray_recorder.capture("HttpFile.read")
+    @metrics.timed("HttpGet")
+    def read(self, size=-1):
+        """Reads the content from the beginning.
+
+        The whole content is cached in source_cache (unless too big)
+        and revalidated with conditional GET (If-None-Match) when read again.
+
+        Raises TooLargeException if the content is bigger than HTTP_MAX_SIZE.
+        """
+        if size > 0:
+            return self.read_range(0, size)
+        cached = source_cache.get(self.uri)
+        response = self._get(if_none_match=cached[0] if cached else None)
+        if response is None:
+            source_cache.count(hit=True)
+            logger.info("Using cached %s" % self.uri)
+            return cached[1]
+        source_cache.count(hit=False)
+        f = BytesIO()
+        self._read_body(response, f)
+        data = f.getvalue()
+        if response.headers.get("ETag"):
+            source_cache.put(self.uri, response.headers["ETag"], data)
+        return data
+
+    @xray_recorder.capture("HttpFile.open")
+    @metrics.timed("HttpGet")
+    def open(self):
+        """Opens the content for reading, cached as by read unless too big (then streamed as by S3File.open)."""
+        cached = source_cache.get(self.uri)
+        response = self._get(if_none_match=cached[0] if cached else None)
+        if response is None:
+            source_cache.count(hit=True)
+            metrics.set_property("SourceCache", "hit")
+            logger.info("Using cached %s" % self.uri)
+            return BytesIO(cached[1])
+        source_cache.count(hit=False)
+        metrics.set_property("SourceCache", "miss")
+        content_length = int(response.headers.get("Content-Length", -1))
+        if 0 <= content_length <= source_cache.max_entry_size:
+            f = BytesIO()
+            self._read_body(response, f)
+            if response.headers.get("ETag"):
+                source_cache.put(self.uri, response.headers["ETag"], f.getvalue())
+        else:
+            logger.info("Streaming %s (%d bytes)" % (self.uri, content_length))
+            f = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            self._read_body(response, f)
+        f.seek(0)
+        return f
+
+    @xray_recorder.capture("HttpFile.read_range")
+    @metrics.timed("HttpGet")
+    def read_range(self, offset, size):
+        byte_range = "bytes={}-{}".format(offset, offset + size - 1)
+        response = self._request(
+            "GET", headers=dict(Range=byte_range), preload_content=False
+        )
+        try:
+            if response.status == 416:
+                # offset is beyond the end of the resource
+                return b""
+            if response.status == 206:
+                return response.read(size)
+            # the origin does not support ranges, the content is read from the beginning
+            data = response.read(offset + size)
+            return data[offset:]
+        finally:
+            _release_conn(response)
+
+    def write(self, data, content_type=None):
+        raise ForbiddenException(self.uri, "write")
+
+    def create(self, data, content_type=None):
+        raise ForbiddenException(self.uri, "write")
+
+    def remove(self):
+        raise ForbiddenException(self.uri, "remove")
+
+    def _get(self, if_none_match=None):
+        """Gets the resource (streamed), conditionally if if_none_match (ETag) is set.
+
+        Returns the response, None if not modified since if_none_match.
+        """
+        headers = {}
+        if if_none_match:
+            headers["If-None-Match"] = if_none_match
+        response = self._request("GET", headers=headers, preload_content=False)
+        if response.status == 304:
+            _release_conn(response)
+            return None
+        if int(response.headers.get("Content-Length", 0)) > HTTP_MAX_SIZE:
+            _release_conn(response)
+            source_cache.remove(self.uri)
+            raise TooLargeException(self.uri, HTTP_MAX_SIZE)
+        return response
+
+    def _read_body(self, response, f):
+        """Reads the body of response (in chunks) to binary file f.
+
+        Raises TooLargeException if it is bigger than HTTP_MAX_SIZE.
+        """
+        size = 0
+        try:
+            for chunk in iter(lambda: response.read(READ_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > HTTP_MAX_SIZE:
+                    raise TooLargeException(self.uri, HTTP_MAX_SIZE)
+                f.write(chunk)
+        finally:
+            _release_conn(response)
+
+    def _request(self, method, headers=None, preload_content=True):
+        """Returns the response if succeeded (2xx) or not modified (304).
+
+        Raises NotFoundException or ForbiddenException if the resource does not exist or is not accessible.
+        Raises RedirectException if the resource is redirected (see HttpFile).
+        Raises UpstreamException in case of other error (of the origin, not of the function).
+        """
+        try:
+            response = HttpFile._http.request(
+                method,
+                self.uri,
+                headers=headers,
+                preload_content=preload_content,
+                redirect=False,
+            )
+        except Exception as e:
+            logger.warning("Failed to %s %s: %s" % (method, self.uri, e))
+            raise UpstreamException(self.uri, e)
+        if response.status < 300 or response.status in (304, 416):
+            return response
+        if not preload_content:
+            _release_conn(response)
+        logger.warning("Failed to %s %s: %d" % (method, self.uri, response.status))
+        source_cache.remove(self.uri)
+        if response.status in (404, 410):
+            raise NotFoundException(self.uri)
+        if response.status in (401, 403):
+            raise ForbiddenException(self.uri, "read")
+        if response.status < 400:
+            raise RedirectException(self.uri, response.headers.get("Location"))
+        raise UpstreamException(self.uri, response.status)
+
+
+def _release_conn(response):
+    """Releases the connection of the streamed HTTP(S) response to the pool,
+    reading the rest of the body if small (see HTTP_DRAIN_MAX_SIZE) or closing the connection otherwise.
+    """
+    remaining = response.length_remaining
+    if remaining is not None and remaining <= HTTP_DRAIN_MAX_SIZE:
+        response.drain_conn()
+    else:
+        response.close()
+    response.release_conn()
+
 
 # TODO: implement tests
@@ -0,0 +1,93 @@
+"""
+Checks the time of importing the function handler module, which is most of the cold start.
+
+Imports the module with python -X importtime in a new process (a few times, the fastest run is used),
+prints the slowest imports and exits with 1 if the module import time exceeds the budget.
+
+Usage: python tools/import_time.py [--path thumbnailer] [--module app] [--budget-ms 1500]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+IMPORT_TIME_PREFIX = "import time:"
+
+
+def import_times(module, path):
+    """Imports the module in a new process.
+
+    Returns list of (package, self time, cumulative time, depth) tuples, times in microseconds.
+    """
+    env = dict(os.environ)
+    # boto3 client is created during the import
+    env.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import {}".format(module)],
+        cwd=path,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if result.returncode != 0:
+        sys.exit("Failed to import {}:\n{}".format(module, result.stderr))
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith(IMPORT_TIME_PREFIX):
+            continue
+        fields = line[len(IMPORT_TIME_PREFIX) :].split("|")
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except ValueError:
+            # header
+            continue
+        package = fields[2].rstrip()
+        depth = (len(package) - len(package.lstrip())) // 2
+        times.append((package.strip(), self_us, cumulative_us, depth))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--path", default="thumbnailer")
+    parser.add_argument("--module", default="app")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=float(os.getenv("IMPORT_TIME_BUDGET_MS", 1500)),
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [import_times(args.module, args.path) for _ in range(args.repeat)]
+
+    def total_us(times):
+        return sum(
+            cumulative_us
+            for package, _, cumulative_us, depth in times
+            if package == args.module and depth == 0
+        )
+
+    times = min(runs, key=total_us)
+    total_ms = total_us(times) / 1000
+
+    print("Slowest imports (cumulative):")
+    top_level = sorted(
+        (t for t in times if 0 < t[3] <= 2), key=lambda t: t[2], reverse=True
+    )
+    for package, _, cumulative_us, depth in top_level[: args.top]:
+        print("{:>10.1f} ms  {}{}".format(cumulative_us / 1000, "  " * depth, package))
+    print(
+        "Import of {} took {:.1f} ms (budget {:.0f} ms)".format(
+            args.module, total_ms, args.budget_ms
+        )
+    )
+    if total_ms > args.budget_ms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()